@@ -0,0 +1,732 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+
+from refractory_home import world_data
+
+LOGGER = logging.getLogger("backups")
+
+BACKUP_CHUNK_SIZE = 1024 * 1024
+# Archive pieces of about BACKUP_CHUNK_SIZE allowed to wait for a slow download
+ZIP_STREAM_QUEUE_SIZE = 4
+# zlib levels offered for backups; 0 stores files as-is, which suits already-compressed assets
+BACKUP_COMPRESS_LEVELS = range(0, 10)
+
+SNAPSHOT_PATH_BASE = "instance_snapshots"
+# Content-addressed chunks, shared by the snapshots of every instance
+SNAPSHOT_OBJECTS_PATH = os.path.join(SNAPSHOT_PATH_BASE, "objects")
+# Manifests, in a directory per instance slug; kept apart from the chunks, so that no
+# slug can name the chunk store
+SNAPSHOT_MANIFESTS_PATH = os.path.join(SNAPSHOT_PATH_BASE, "manifests")
+SNAPSHOT_CHUNK_SIZE = 4 * 1024 * 1024
+SNAPSHOT_ID_FORMAT = "%Y%m%dT%H%M%S%fZ"
+SNAPSHOT_SUMMARY_KEYS = ["id", "file_count", "total_size", "stored_size", "worlds"]
+
+WORLD_EXPORT_DIR = "world_exports"
+WORLD_EXPORT_EXTENSION = ".rldb.gz"
+WORLD_EXPORT_MAGIC = b"RLDBX1\n"
+# Export records are (collection, key, value), each prefixed with its length
+WORLD_EXPORT_RECORD_HEADER = struct.Struct(">HII")
+WORLD_IMPORT_BATCH_SIZE = 1000
+# Siblings of a world's data directory while an import is written and swapped in
+WORLD_IMPORT_STAGING_SUFFIX = ".import"
+WORLD_IMPORT_REPLACED_SUFFIX = ".replaced"
+
+# Held while snapshots are written or chunks are collected, so a chunk can't be removed
+# between being stored and being recorded in a manifest
+_snapshot_store_lock = threading.RLock()
+_manifest_dirs_migrated = False
+
+
+class _ZipStreamCancelled(Exception):
+    pass
+
+
+class _ZipStreamWriter:
+    """
+    Unseekable file object that passes what ZipFile writes on to a bounded queue, in
+    pieces of about BACKUP_CHUNK_SIZE, so the archive is never held in memory whole.
+    """
+
+    def __init__(self, pieces, cancelled):
+        self.pieces = pieces
+        self.cancelled = cancelled
+        self.chunks = []
+        self.chunks_size = 0
+        self.offset = 0
+
+    def put(self, piece):
+        while True:
+            if self.cancelled.is_set():
+                raise _ZipStreamCancelled()
+            try:
+                self.pieces.put(piece, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.chunks_size += len(data)
+        self.offset += len(data)
+        if self.chunks_size >= BACKUP_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        if self.chunks:
+            piece = b"".join(self.chunks)
+            self.chunks = []
+            self.chunks_size = 0
+            self.put(piece)
+
+
+def _stream_zip(write_entries, compress_level=0):
+    """
+    Builds a zip archive on a separate thread, with write_entries(archive) adding its
+    entries, and yields the archive in pieces as it is written. Stopping the generator
+    early, such as when a download is cancelled, stops the thread too.
+    """
+    compression = zipfile.ZIP_DEFLATED if compress_level else zipfile.ZIP_STORED
+    pieces = queue.Queue(maxsize=ZIP_STREAM_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    def write_archive():
+        writer = _ZipStreamWriter(pieces, cancelled)
+        try:
+            with zipfile.ZipFile(
+                writer,
+                "w",
+                compression=compression,
+                compresslevel=compress_level or None,
+            ) as archive:
+                write_entries(archive)
+            writer.flush()
+        except _ZipStreamCancelled:
+            return
+        except Exception:
+            LOGGER.exception("backup archive couldn't be written")
+        try:
+            writer.put(None)
+        except _ZipStreamCancelled:
+            pass
+
+    threading.Thread(target=write_archive, name="zip_stream", daemon=True).start()
+
+    def generate():
+        try:
+            while (piece := pieces.get()) is not None:
+                yield piece
+        finally:
+            cancelled.set()
+
+    return generate()
+
+
+def _write_file_entry(archive, file_path, arcname):
+    entry_count = len(archive.filelist)
+    try:
+        archive.write(file_path, arcname)
+    except OSError:
+        if len(archive.filelist) > entry_count:
+            # the entry was started, so what was read of the file is in the archive
+            LOGGER.error(
+                f"{arcname} in backup is corrupt, {file_path} couldn't be read completely"
+            )
+        else:
+            LOGGER.warning(f"skipping {file_path} in backup, couldn't be read")
+
+
+def stream_zip(files, compress_level=0):
+    """Builds a zip archive on the fly, yielding it in pieces as it is written.
+
+    Memory use stays around ZIP_STREAM_QUEUE_SIZE * BACKUP_CHUNK_SIZE no matter how
+    large the files are.
+
+    :param files: Iterable of (file path, name in archive) pairs
+    :param compress_level: 0 to store files uncompressed, or a deflate level from 1-9
+    :return: A generator of archive bytes
+    """
+
+    def write_entries(archive):
+        for file_path, arcname in files:
+            _write_file_entry(archive, file_path, arcname)
+
+    return _stream_zip(write_entries, compress_level=compress_level)
+
+
+def instance_backup_files(instance):
+    """
+    Lists the files in an instance's Data directory, as (file path, name in archive) pairs.
+    """
+    data_path = os.path.join(instance.data_path, "Data")
+    for root, dirs, files in os.walk(data_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            yield file_path, os.path.relpath(file_path)
+
+
+def stream_instance_backup(instance, compress_level=0):
+    return stream_zip(instance_backup_files(instance), compress_level=compress_level)
+
+
+#
+# Snapshots
+#
+
+
+def _migrate_legacy_manifest_dirs():
+    """
+    Moves manifest directories kept straight under SNAPSHOT_PATH_BASE, next to the
+    chunk store, by earlier versions into SNAPSHOT_MANIFESTS_PATH.
+    """
+    global _manifest_dirs_migrated
+    if _manifest_dirs_migrated:
+        return
+    with _snapshot_store_lock:
+        if os.path.isdir(SNAPSHOT_PATH_BASE):
+            for entry_name in os.listdir(SNAPSHOT_PATH_BASE):
+                entry_path = os.path.join(SNAPSHOT_PATH_BASE, entry_name)
+                if entry_path in (SNAPSHOT_OBJECTS_PATH, SNAPSHOT_MANIFESTS_PATH):
+                    continue
+                if os.path.isdir(entry_path):
+                    os.makedirs(SNAPSHOT_MANIFESTS_PATH, exist_ok=True)
+                    os.replace(
+                        entry_path, os.path.join(SNAPSHOT_MANIFESTS_PATH, entry_name)
+                    )
+        _manifest_dirs_migrated = True
+
+
+def _snapshot_dir(instance) -> str:
+    _migrate_legacy_manifest_dirs()
+    return os.path.join(SNAPSHOT_MANIFESTS_PATH, instance.instance_slug)
+
+
+def snapshot_has_world(manifest, world_id) -> bool:
+    """Whether world_id names a world in the snapshot, and can't leave its directory."""
+    if not world_id or world_id in (".", "..") or os.sep in world_id:
+        return False
+    if os.altsep and os.altsep in world_id:
+        return False
+    return world_id in manifest.get("worlds", [])
+
+
+def _chunk_path(chunk_hash) -> str:
+    return os.path.join(SNAPSHOT_OBJECTS_PATH, chunk_hash[:2], chunk_hash)
+
+
+def _store_chunk(chunk) -> tuple:
+    """
+    Stores a chunk under its hash, returning the hash and whether it was new to the store.
+    """
+    chunk_hash = hashlib.sha256(chunk).hexdigest()
+    chunk_path = _chunk_path(chunk_hash)
+    if os.path.exists(chunk_path):
+        return chunk_hash, False
+    os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+    temp_path = f"{chunk_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as chunk_file:
+        chunk_file.write(chunk)
+    os.replace(temp_path, chunk_path)
+    return chunk_hash, True
+
+
+def _read_snapshot_chunks(chunk_hashes):
+    for chunk_hash in chunk_hashes:
+        with open(_chunk_path(chunk_hash), "rb") as chunk_file:
+            yield chunk_file.read()
+
+
+def _snapshot_ids(instance) -> list:
+    snapshot_dir = _snapshot_dir(instance)
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(
+        [
+            file_name[: -len(".json")]
+            for file_name in os.listdir(snapshot_dir)
+            if file_name.endswith(".json")
+        ],
+        reverse=True,
+    )
+
+
+def list_snapshots(instance) -> list:
+    """Lists an instance's snapshots, newest first.
+
+    :param instance: The FoundryInstance to list snapshots for
+    :return: Snapshot summaries, each a dict with id, created, file_count, total_size,
+        stored_size (the bytes that snapshot added to the store) and worlds
+    :rtype: list
+    """
+    snapshots = []
+    for snapshot_id in _snapshot_ids(instance):
+        manifest = load_snapshot(instance, snapshot_id)
+        if manifest:
+            summary = {key: manifest.get(key) for key in SNAPSHOT_SUMMARY_KEYS}
+            summary["created"] = datetime.fromisoformat(manifest["created"])
+            snapshots.append(summary)
+    return snapshots
+
+
+def load_snapshot(instance, snapshot_id) -> dict | None:
+    manifest_path = os.path.join(_snapshot_dir(instance), f"{snapshot_id}.json")
+    # ids come from urls, so only accept ones that name a manifest in this directory
+    if os.path.basename(manifest_path) != f"{snapshot_id}.json":
+        return None
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def snapshot_instance(instance) -> dict:
+    """Takes an incremental snapshot of an instance's Data directory.
+
+    Files are split into chunks that are stored by content hash, so unchanged data is
+    never stored twice. Files whose size and mtime match the previous snapshot reuse its
+    chunk list without being read at all.
+
+    :param instance: The FoundryInstance to snapshot
+    :return: The new snapshot's manifest
+    :rtype: dict
+    """
+    with _snapshot_store_lock:
+        started = time.monotonic()
+        snapshot_ids = _snapshot_ids(instance)
+        previous = load_snapshot(instance, snapshot_ids[0]) if snapshot_ids else None
+        previous_files = previous.get("files", {}) if previous else {}
+
+        created = datetime.now(timezone.utc)
+        files = {}
+        stored_size = 0
+        data_path = os.path.join(instance.data_path, "Data")
+        for root, dirs, file_names in os.walk(data_path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(file_path, instance.data_path)
+                try:
+                    file_stat = os.stat(file_path)
+                    previous_entry = previous_files.get(relative_path)
+                    if (
+                        previous_entry
+                        and previous_entry["size"] == file_stat.st_size
+                        and previous_entry["mtime_ns"] == file_stat.st_mtime_ns
+                    ):
+                        files[relative_path] = previous_entry
+                        continue
+                    chunk_hashes = []
+                    with open(file_path, "rb") as source_file:
+                        while chunk := source_file.read(SNAPSHOT_CHUNK_SIZE):
+                            chunk_hash, is_new = _store_chunk(chunk)
+                            chunk_hashes.append(chunk_hash)
+                            if is_new:
+                                stored_size += len(chunk)
+                except OSError:
+                    LOGGER.warning(
+                        f"skipping {file_path} in snapshot, couldn't be read"
+                    )
+                    continue
+                files[relative_path] = {
+                    "size": file_stat.st_size,
+                    "mtime_ns": file_stat.st_mtime_ns,
+                    "chunks": chunk_hashes,
+                }
+
+        worlds_prefix = os.path.join("Data", "worlds") + os.sep
+        manifest = {
+            "id": created.strftime(SNAPSHOT_ID_FORMAT),
+            "instance": instance.instance_slug,
+            "created": created.isoformat(),
+            "file_count": len(files),
+            "total_size": sum(entry["size"] for entry in files.values()),
+            "stored_size": stored_size,
+            "worlds": sorted(
+                {
+                    path[len(worlds_prefix) :].split(os.sep)[0]
+                    for path in files
+                    if path.startswith(worlds_prefix)
+                }
+            ),
+            "files": files,
+        }
+        snapshot_dir = _snapshot_dir(instance)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        manifest_path = os.path.join(snapshot_dir, f"{manifest['id']}.json")
+        with open(f"{manifest_path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        LOGGER.info(
+            f"snapshot {manifest['id']} of {instance.instance_name}: {len(files)} files, {stored_size} new bytes in {time.monotonic() - started:.1f}s"
+        )
+        return manifest
+
+
+def restore_snapshot(instance, snapshot_id, world_id=None) -> bool:
+    """Restores an instance's Data directory, or a single world, from a snapshot.
+
+    Files are written back from the chunk store, and files created since the snapshot
+    are removed, so the restored directory matches the snapshot exactly.
+
+    :param instance: The FoundryInstance to restore
+    :param snapshot_id: The id of the snapshot to restore from
+    :param world_id: A world to restore on its own; when not set, all of Data is restored
+    :return: Whether the snapshot was found and restored
+    :rtype: bool
+    """
+    manifest = load_snapshot(instance, snapshot_id)
+    if not manifest:
+        return False
+    if world_id:
+        # everything under the restore root that isn't in the snapshot is deleted, so
+        # only worlds the snapshot actually has can be restored
+        if not snapshot_has_world(manifest, world_id):
+            return False
+        restore_root = os.path.join("Data", "worlds", world_id)
+    else:
+        restore_root = "Data"
+    restore_prefix = restore_root + os.sep
+    files = {
+        path: entry
+        for path, entry in manifest["files"].items()
+        if path.startswith(restore_prefix)
+    }
+
+    # keeps the snapshot's chunks from being collected while they're read
+    with _snapshot_store_lock:
+        restore_path = os.path.join(instance.data_path, restore_root)
+        for root, dirs, file_names in os.walk(restore_path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                if os.path.relpath(file_path, instance.data_path) not in files:
+                    os.remove(file_path)
+        for relative_path, entry in files.items():
+            file_path = os.path.join(instance.data_path, relative_path)
+            current_stat = os.stat(file_path) if os.path.exists(file_path) else None
+            if (
+                current_stat
+                and current_stat.st_size == entry["size"]
+                and current_stat.st_mtime_ns == entry["mtime_ns"]
+            ):
+                continue
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(f"{file_path}.restore", "wb") as restored_file:
+                for chunk in _read_snapshot_chunks(entry["chunks"]):
+                    restored_file.write(chunk)
+            os.replace(f"{file_path}.restore", file_path)
+            os.utime(file_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return True
+
+
+def stream_snapshot_zip(instance, snapshot_id, compress_level=0):
+    """Exports a snapshot as a zip, in the same layout as a regular instance backup.
+
+    :return: A generator of archive bytes, or None if the snapshot doesn't exist
+    """
+    manifest = load_snapshot(instance, snapshot_id)
+    if not manifest:
+        return None
+
+    def write_entries(archive):
+        os.makedirs(SNAPSHOT_PATH_BASE, exist_ok=True)
+        for relative_path, entry in manifest["files"].items():
+            arcname = os.path.join(instance.data_path, relative_path)
+            # written out so ZipFile can add it like any other file, with its mtime
+            with tempfile.NamedTemporaryFile(
+                dir=SNAPSHOT_PATH_BASE, suffix=".export", delete=False
+            ) as export_file:
+                export_path = export_file.name
+                try:
+                    for chunk in _read_snapshot_chunks(entry["chunks"]):
+                        export_file.write(chunk)
+                except OSError:
+                    LOGGER.warning(
+                        f"skipping {relative_path} in snapshot export, missing chunks"
+                    )
+                    export_path = None
+            try:
+                if export_path:
+                    os.chmod(export_file.name, 0o644)
+                    os.utime(
+                        export_file.name, ns=(entry["mtime_ns"], entry["mtime_ns"])
+                    )
+                    _write_file_entry(archive, export_file.name, arcname)
+            finally:
+                os.remove(export_file.name)
+
+    return _stream_zip(write_entries, compress_level=compress_level)
+
+
+def prune_snapshots(instance, keep):
+    for snapshot_id in _snapshot_ids(instance)[keep:]:
+        os.remove(os.path.join(_snapshot_dir(instance), f"{snapshot_id}.json"))
+
+
+def collect_snapshot_garbage() -> int:
+    """Removes chunks that no snapshot manifest refers to any more.
+
+    :return: The number of chunks removed
+    :rtype: int
+    """
+    _migrate_legacy_manifest_dirs()
+    with _snapshot_store_lock:
+        referenced = set()
+        if not os.path.isdir(SNAPSHOT_MANIFESTS_PATH):
+            return 0
+        for instance_dir in os.listdir(SNAPSHOT_MANIFESTS_PATH):
+            manifest_dir = os.path.join(SNAPSHOT_MANIFESTS_PATH, instance_dir)
+            if not os.path.isdir(manifest_dir):
+                continue
+            for file_name in os.listdir(manifest_dir):
+                if file_name.endswith(".json"):
+                    with open(os.path.join(manifest_dir, file_name)) as manifest_file:
+                        for entry in json.load(manifest_file)["files"].values():
+                            referenced.update(entry["chunks"])
+        removed = 0
+        for root, dirs, file_names in os.walk(SNAPSHOT_OBJECTS_PATH):
+            for file_name in file_names:
+                if file_name not in referenced:
+                    os.remove(os.path.join(root, file_name))
+                    removed += 1
+        return removed
+
+
+def snapshot_all_instances(keep=None):
+    """
+    Snapshots every instance, then prunes each down to its newest keep snapshots and
+    collects chunks that are no longer used; meant to be run on a schedule.
+    """
+    from refractory_home.models import FoundryInstance
+
+    for instance in FoundryInstance.objects.exclude(instance_slug=None):
+        try:
+            # the raw files of a running world's databases can be torn mid-write, so it
+            # also gets a consistent export when that can be done without kicking players
+            world_id = instance.active_world_id if instance.is_active else None
+            if world_id and instance.uses_level_db:
+                instance.export_world(world_id, interrupt_players=False)
+            snapshot_instance(instance)
+            if keep:
+                prune_snapshots(instance, keep)
+        except Exception:
+            LOGGER.exception(f"snapshot of {instance.instance_name} failed")
+    if os.path.isdir(SNAPSHOT_PATH_BASE):
+        collect_snapshot_garbage()
+
+
+#
+# World database exports
+#
+
+
+def _leveldb_collections(world_data_path) -> list:
+    """Lists the LevelDB databases (one per document collection) in a world's data dir."""
+    if not os.path.isdir(world_data_path):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(world_data_path)
+        if os.path.isfile(os.path.join(world_data_path, name, "CURRENT"))
+    )
+
+
+def export_world_databases(world_data_path, export_path) -> int:
+    """Dumps every LevelDB collection of a world into a single compact export file.
+
+    Each collection is read through a LevelDB snapshot, so it is consistent even if it
+    is written to during the export. The databases can't be open in foundry, which
+    holds their LOCK files while the world is running.
+
+    :param world_data_path: The world's data directory, such as Data/worlds/<id>/data
+    :param export_path: The file to write the gzip compressed export to
+    :return: The number of records exported
+    :rtype: int
+    """
+    records = 0
+    os.makedirs(os.path.dirname(export_path), exist_ok=True)
+    with gzip.open(f"{export_path}.tmp", "wb") as export_file:
+        export_file.write(WORLD_EXPORT_MAGIC)
+        for collection in _leveldb_collections(world_data_path):
+            collection_bytes = collection.encode()
+            with (
+                world_data.open_level_db(
+                    os.path.join(world_data_path, collection)
+                ) as db,
+                db.snapshot() as snapshot,
+            ):
+                for key, value in snapshot.iterator():
+                    export_file.write(
+                        WORLD_EXPORT_RECORD_HEADER.pack(
+                            len(collection_bytes), len(key), len(value)
+                        )
+                    )
+                    export_file.write(collection_bytes)
+                    export_file.write(key)
+                    export_file.write(value)
+                    records += 1
+    os.replace(f"{export_path}.tmp", export_path)
+    return records
+
+
+def _read_world_export(export_path):
+    with gzip.open(export_path, "rb") as export_file:
+        if export_file.read(len(WORLD_EXPORT_MAGIC)) != WORLD_EXPORT_MAGIC:
+            raise ValueError(f"{export_path} is not a world database export")
+        while header := export_file.read(WORLD_EXPORT_RECORD_HEADER.size):
+            collection_length, key_length, value_length = (
+                WORLD_EXPORT_RECORD_HEADER.unpack(header)
+            )
+            collection = export_file.read(collection_length).decode()
+            yield collection, export_file.read(key_length), export_file.read(
+                value_length
+            )
+
+
+def _recover_world_data_swap(world_data_path):
+    replaced_path = f"{world_data_path}{WORLD_IMPORT_REPLACED_SUFFIX}"
+    if os.path.isdir(replaced_path):
+        if not os.path.exists(world_data_path):
+            # stopped between the two renames of a swap; the old databases are intact
+            os.replace(replaced_path, world_data_path)
+        else:
+            shutil.rmtree(replaced_path)
+    staging_path = f"{world_data_path}{WORLD_IMPORT_STAGING_SUFFIX}"
+    if os.path.isdir(staging_path):
+        shutil.rmtree(staging_path)
+
+
+def import_world_databases(world_data_path, export_path) -> int:
+    """Writes a world database export back, replacing the world's current contents.
+
+    The export is written into fresh databases next to the world's, in LevelDB write
+    batches of WORLD_IMPORT_BATCH_SIZE, and these only replace the world's data
+    directory once every record is in. A failed import leaves the world as it was.
+    Collections that aren't in the export end up empty. As with exporting, the world
+    must not be running.
+
+    :param world_data_path: The world's data directory, such as Data/worlds/<id>/data
+    :param export_path: An export written by export_world_databases
+    :return: The number of records imported
+    :rtype: int
+    :raises WorldDatabaseLocked: If foundry has the world open
+    """
+    _recover_world_data_swap(world_data_path)
+    # fail before doing any work if foundry holds the world's databases
+    for collection in _leveldb_collections(world_data_path):
+        with world_data.open_level_db(os.path.join(world_data_path, collection)):
+            pass
+
+    staging_path = f"{world_data_path}{WORLD_IMPORT_STAGING_SUFFIX}"
+    os.makedirs(staging_path)
+    records = 0
+    try:
+        with contextlib.ExitStack() as open_databases:
+            databases = {}
+            batches = {}
+            for collection, key, value in _read_world_export(export_path):
+                if (
+                    collection in (".", "..")
+                    or os.path.basename(collection) != collection
+                ):
+                    raise ValueError(f"bad collection name {collection} in export")
+                if collection not in databases:
+                    databases[collection] = open_databases.enter_context(
+                        world_data.open_level_db(
+                            os.path.join(staging_path, collection),
+                            create_if_missing=True,
+                        )
+                    )
+                if collection not in batches:
+                    batches[collection] = databases[collection].write_batch()
+                batches[collection].put(key, value)
+                records += 1
+                if records % WORLD_IMPORT_BATCH_SIZE == 0:
+                    for pending_batch in batches.values():
+                        pending_batch.write()
+                    batches = {}
+            for pending_batch in batches.values():
+                pending_batch.write()
+        if os.path.isdir(world_data_path):
+            # anything kept alongside the collections comes along unchanged
+            collections = set(_leveldb_collections(world_data_path))
+            for name in os.listdir(world_data_path):
+                source = os.path.join(world_data_path, name)
+                target = os.path.join(staging_path, name)
+                if name in collections or os.path.lexists(target):
+                    continue
+                if os.path.isdir(source) and not os.path.islink(source):
+                    shutil.copytree(source, target, symlinks=True)
+                else:
+                    shutil.copy2(source, target, follow_symlinks=False)
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        raise
+
+    replaced_path = f"{world_data_path}{WORLD_IMPORT_REPLACED_SUFFIX}"
+    if os.path.isdir(world_data_path):
+        os.replace(world_data_path, replaced_path)
+    os.replace(staging_path, world_data_path)
+    shutil.rmtree(replaced_path, ignore_errors=True)
+    return records
+
+
+def _world_export_dir(instance, world_id) -> str:
+    return os.path.join(_snapshot_dir(instance), WORLD_EXPORT_DIR, world_id)
+
+
+def world_export_path(instance, world_id, export_id) -> str | None:
+    # ids come from urls, so only accept plain names
+    for name in [world_id, export_id]:
+        if not name or name in [".", ".."] or os.path.basename(name) != name:
+            return None
+    return os.path.join(
+        _world_export_dir(instance, world_id), f"{export_id}{WORLD_EXPORT_EXTENSION}"
+    )
+
+
+def new_world_export_path(instance, world_id) -> str:
+    export_id = datetime.now(timezone.utc).strftime(SNAPSHOT_ID_FORMAT)
+    return world_export_path(instance, world_id, export_id)
+
+
+def list_world_exports(instance) -> list:
+    """Lists an instance's world database exports, newest first.
+
+    :return: Exports, each a dict with world_id, id, created and size
+    :rtype: list
+    """
+    exports_root = os.path.join(_snapshot_dir(instance), WORLD_EXPORT_DIR)
+    if not os.path.isdir(exports_root):
+        return []
+    exports = []
+    for world_id in os.listdir(exports_root):
+        for file_name in os.listdir(os.path.join(exports_root, world_id)):
+            if file_name.endswith(WORLD_EXPORT_EXTENSION):
+                export_id = file_name[: -len(WORLD_EXPORT_EXTENSION)]
+                exports.append(
+                    {
+                        "world_id": world_id,
+                        "id": export_id,
+                        "created": datetime.strptime(
+                            export_id, SNAPSHOT_ID_FORMAT
+                        ).replace(tzinfo=timezone.utc),
+                        "size": os.path.getsize(
+                            os.path.join(exports_root, world_id, file_name)
+                        ),
+                    }
+                )
+    return sorted(exports, key=lambda export: export["id"], reverse=True)
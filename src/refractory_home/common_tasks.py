@@ -1,23 +1,84 @@
+import threading
 from django.utils import timezone
 from datetime import timedelta
 from functools import wraps
-import requests
+from django.core.cache import cache
 from django.db import transaction
 from web_interaction import foundry_interaction
 
+LIMIT_REFRESH_CACHE_PREFIX = "limit_refresh"
+
+
+def limit_refresh(limit_refresh_seconds=0, default=None, wait=True, key=None):
+    """Limits a function to running at most once per limit_refresh_seconds.
+
+    Calls are single-flight: one caller runs the function while concurrent callers
+    either wait for it (wait=True) or return immediately, and in both cases get the
+    last result (or default, before the first run). The last run's timestamp and
+    result are kept together in the django cache, so the limit and the result are
+    shared between threads and survive restarts; results must be picklable.
+
+    :param limit_refresh_seconds: Minimum time between runs; 0 to always run
+    :param default: Value returned when throttled before any run has finished
+    :param wait: Whether concurrent callers block until the running call is done
+    :param key: Cache key for the last run, or a callable building one from the call
+        arguments; defaults to the function's qualified name
+    """
 
-def limit_refresh(limit_refresh_seconds=0, default=None):
     def limit_refresh_decorator(func):
+        default_key = (
+            f"{LIMIT_REFRESH_CACHE_PREFIX}:{func.__module__}.{func.__qualname__}"
+        )
+        locks = {}
+        locks_lock = threading.Lock()
+
+        def get_key(args, kwargs):
+            if callable(key):
+                return f"{default_key}:{key(*args, **kwargs)}"
+            return key if key else default_key
+
+        def get_last_run(cache_key):
+            """:return: (timestamp, result) of the last run, or None"""
+            last_run = cache.get(cache_key)
+            # timestamps stored on their own by older versions carry no result
+            return last_run if isinstance(last_run, tuple) else None
+
+        def is_fresh(last_run):
+            if last_run is None:
+                return False
+            return timezone.now() - last_run[0] <= timedelta(
+                seconds=limit_refresh_seconds
+            )
+
+        def last_result(last_run):
+            return default if last_run is None else last_run[1]
+
         @wraps(func)
         def wrapped_func(*args, **kwargs):
-            if limit_refresh_seconds > 0:
-                now = timezone.now()
-                if hasattr(wrapped_func, "refresh_timestamp"):
-                    old = getattr(wrapped_func, "refresh_timestamp")
-                    if now - old <= timedelta(seconds=limit_refresh_seconds):
-                        return default
-                setattr(wrapped_func, "refresh_timestamp", now)
+            if limit_refresh_seconds <= 0:
                 return func(*args, **kwargs)
+            cache_key = get_key(args, kwargs)
+            last_run = get_last_run(cache_key)
+            if is_fresh(last_run):
+                return last_result(last_run)
+            with locks_lock:
+                lock = locks.setdefault(cache_key, threading.Lock())
+            if not lock.acquire(blocking=wait):
+                return last_result(last_run)
+            try:
+                # another caller may have refreshed while this one was waiting
+                last_run = get_last_run(cache_key)
+                if is_fresh(last_run):
+                    return last_result(last_run)
+                result = last_result(last_run)
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    # failed runs count too, so a flaky remote isn't retried on every call
+                    cache.set(cache_key, (timezone.now(), result), timeout=None)
+                return result
+            finally:
+                lock.release()
 
         return wrapped_func
 
@@ -27,36 +88,36 @@ def limit_refresh(limit_refresh_seconds=0, default=None):
 def load_foundry_releases_immediate():
     from refractory_home.models import FoundryVersion
 
-    with requests.Session() as rsession:
-        versions = foundry_interaction.get_releases(rsession)
-        with transaction.atomic():
-            for release in versions:
-                version_string = release.get("version")
-                build = release.get("build")
-                update_type, update_category = (
-                    FoundryVersion.UpdateType.FULL,
-                    FoundryVersion.UpdateCategory.STABLE,
-                )
-                for tag in release.get("tags"):
-                    if tag in FoundryVersion.UpdateType:
-                        update_type = tag
-                    elif tag in FoundryVersion.UpdateCategory:
-                        update_category = tag
-                FoundryVersion.objects.update_or_create(
-                    version_string=version_string,
-                    defaults=dict(
-                        update_type=update_type,
-                        update_category=update_category,
-                        build=build,
-                    ),
-                )
-            for version in FoundryVersion.objects.all():
-                if version.download_status == FoundryVersion.DownloadStatus.DOWNLOADED:
-                    if not foundry_interaction.release_artifact_exists(version):
-                        version.download_status = (
-                            FoundryVersion.DownloadStatus.NOT_DOWNLOADED
-                        )
-                        version.save()
+    rsession = foundry_interaction.get_site_session()
+    versions = foundry_interaction.get_releases(rsession)
+    with transaction.atomic():
+        for release in versions:
+            version_string = release.get("version")
+            build = release.get("build")
+            update_type, update_category = (
+                FoundryVersion.UpdateType.FULL,
+                FoundryVersion.UpdateCategory.STABLE,
+            )
+            for tag in release.get("tags"):
+                if tag in FoundryVersion.UpdateType:
+                    update_type = tag
+                elif tag in FoundryVersion.UpdateCategory:
+                    update_category = tag
+            FoundryVersion.objects.update_or_create(
+                version_string=version_string,
+                defaults=dict(
+                    update_type=update_type,
+                    update_category=update_category,
+                    build=build,
+                ),
+            )
+        for version in FoundryVersion.objects.all():
+            if version.download_status == FoundryVersion.DownloadStatus.DOWNLOADED:
+                if not foundry_interaction.release_artifact_exists(version):
+                    version.download_status = (
+                        FoundryVersion.DownloadStatus.NOT_DOWNLOADED
+                    )
+                    version.save()
 
 
 @limit_refresh(limit_refresh_seconds=60)
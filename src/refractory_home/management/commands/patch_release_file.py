@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from refractory_home.models import FoundryInstance
+
+
+class Command(BaseCommand):
+    help = (
+        "Gives an instance its own writable copy of a file in its foundry release, and "
+        "prints where it is, so the file can be patched for that instance alone. The "
+        "instance picks up the change the next time it is activated."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("instance_slug")
+        parser.add_argument(
+            "relative_path",
+            nargs="?",
+            help="Path of the file, relative to the release root",
+        )
+        parser.add_argument(
+            "--remove-overlay",
+            action="store_true",
+            help="Drop all of the instance's patched files, returning it to the shared release",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            instance = FoundryInstance.objects.get(
+                instance_slug=options["instance_slug"]
+            )
+        except FoundryInstance.DoesNotExist:
+            raise CommandError(f"No instance {options['instance_slug']}")
+        if options["remove_overlay"]:
+            instance.remove_release_overlay()
+            self.stdout.write(
+                f"Removed the release overlay of {instance.instance_name}"
+            )
+            return
+        if not options["relative_path"]:
+            raise CommandError("Give a file to patch, or --remove-overlay")
+        try:
+            patched_path = instance.patch_release_file(options["relative_path"])
+        except (OSError, ValueError) as ex:
+            raise CommandError(f"Couldn't copy {options['relative_path']}: {ex}")
+        self.stdout.write(patched_path)
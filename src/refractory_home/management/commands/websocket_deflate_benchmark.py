@@ -0,0 +1,98 @@
+import base64
+import functools
+import os
+
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
+from django.core.management.base import BaseCommand
+from twisted.internet.testing import StringTransport
+
+from refractory_settings import (
+    WEBSOCKET_DEFLATE_MEM_LEVEL,
+    WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER,
+    WEBSOCKET_DEFLATE_WINDOW_BITS,
+)
+from web_interaction.compression import accept_permessage_deflate
+
+# What a browser offers when opening a websocket
+BROWSER_EXTENSION_OFFER = "permessage-deflate; client_max_window_bits"
+
+
+def replay_wire_bytes(payloads, accept=None) -> int:
+    """
+    Sends the payloads to a browser through an autobahn server protocol, negotiated
+    as the proxy negotiates it, and counts the bytes written after the handshake.
+
+    :param accept: The perMessageCompressionAccept to negotiate with, or None to not
+        compress
+    """
+    factory = WebSocketServerFactory()
+    factory.setProtocolOptions(openHandshakeTimeout=0, closeHandshakeTimeout=0)
+    if accept:
+        factory.setProtocolOptions(perMessageCompressionAccept=accept)
+    factory.protocol = WebSocketServerProtocol
+    protocol = factory.buildProtocol(None)
+    transport = StringTransport()
+    protocol.makeConnection(transport)
+    key = base64.b64encode(os.urandom(16)).decode("ascii")
+    protocol.dataReceived(
+        (
+            "GET / HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            f"Sec-WebSocket-Extensions: {BROWSER_EXTENSION_OFFER}\r\n"
+            "\r\n"
+        ).encode("ascii")
+    )
+    transport.clear()
+    for payload in payloads:
+        protocol.sendMessage(payload)
+    return len(transport.value())
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays recorded socket.io messages, one per line, through the websocket proxy's "
+        "permessage-deflate, and reports the bytes on the wire with and without it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("replay_file", help="Recorded messages, one per line")
+        parser.add_argument(
+            "--window-bits",
+            type=int,
+            nargs="+",
+            default=[WEBSOCKET_DEFLATE_WINDOW_BITS],
+        )
+        parser.add_argument(
+            "--mem-level", type=int, nargs="+", default=[WEBSOCKET_DEFLATE_MEM_LEVEL]
+        )
+        parser.add_argument(
+            "--no-context-takeover",
+            action="store_true",
+            default=WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER,
+        )
+
+    def handle(self, *args, **options):
+        with open(options["replay_file"], "rb") as replay_file:
+            payloads = [line.rstrip(b"\r\n") for line in replay_file if line.strip()]
+        raw_bytes = replay_wire_bytes(payloads)
+        self.stdout.write(f"{len(payloads)} messages, {raw_bytes} bytes uncompressed")
+        for window_bits in options["window_bits"]:
+            for mem_level in options["mem_level"]:
+                deflated_bytes = replay_wire_bytes(
+                    payloads,
+                    accept=functools.partial(
+                        accept_permessage_deflate,
+                        window_bits=window_bits,
+                        mem_level=mem_level,
+                        no_context_takeover=options["no_context_takeover"],
+                    ),
+                )
+                self.stdout.write(
+                    f"window_bits={window_bits} mem_level={mem_level}: "
+                    f"{deflated_bytes} bytes, "
+                    f"{deflated_bytes / max(raw_bytes, 1):.1%} of uncompressed"
+                )
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.4 on 2026-10-19 13:57
+
+from django.db import migrations, models
+
+
+def populate_version_numbers(apps, schema_editor):
+    FoundryVersion = apps.get_model("refractory_home", "FoundryVersion")
+    for version in FoundryVersion.objects.all():
+        try:
+            parts = [int(part) for part in version.version_string.split(".")]
+        except ValueError:
+            continue
+        if len(parts) > 1 and parts[0] == 0:
+            parts = parts[1:]
+        parts = (parts + [0, 0, 0])[:3]
+        version.version_major, version.version_minor, version.version_build = parts
+        version.save(update_fields=["version_major", "version_minor", "version_build"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("refractory_home", "0005_foundryinvite_details"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foundryversion",
+            name="version_build",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="foundryversion",
+            name="version_major",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="foundryversion",
+            name="version_minor",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="foundryversion",
+            index=models.Index(
+                fields=["version_major", "version_minor", "version_build"],
+                name="foundryversion_version_idx",
+            ),
+        ),
+        migrations.RunPython(
+            populate_version_numbers, reverse_code=migrations.RunPython.noop
+        ),
+    ]
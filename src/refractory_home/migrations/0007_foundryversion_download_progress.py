@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("refractory_home", "0006_foundryversion_version_numbers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foundryversion",
+            name="download_progress",
+            field=models.PositiveSmallIntegerField(
+                default=0, editable=False, help_text="Download progress percentage"
+            ),
+        ),
+    ]
@@ -1,13 +1,13 @@
 import json
 import logging
 import os
-import pathlib
 import re
 import secrets
 import shutil
 import string
 import time
 import typing
+import uuid
 from datetime import timedelta
 from enum import Enum
 
@@ -27,16 +27,18 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from websockets.sync.client import connect
 
-from refractory_settings import SERVER_PORT
+from refractory_home import backups, thumbnails, world_data
+from refractory_settings import SERVER_PORT, WORLD_SHUTDOWN_TIMEOUT
 from web_interaction import foundry_interaction
 from web_interaction.foundry_resource import INSTANCE_PATH
 from web_server import RefractoryServer
 from twisted.internet import reactor
 
-import plyvel
-
 DATA_PATH_BASE = "instance_data"
 RELEASE_PATH_BASE = "foundry_releases"
+# Per-instance overlays of release trees; kept on the same mount as the releases so
+# they can be hardlinked, and out of the data path, which foundry won't run from
+RELEASE_OVERLAY_PATH_BASE = os.path.join(RELEASE_PATH_BASE, "instance_overlays")
 
 
 class FoundryState(Enum):
@@ -75,6 +77,23 @@ def generate_default_password() -> str:
     return secrets.token_hex(32)
 
 
+def parse_version_numbers(version_string) -> typing.Tuple[int, int, int]:
+    """Splits a foundry version string into (major, minor, build) integers.
+
+    Legacy 0.x releases drop the leading zero, so that major lines up with
+    FoundryVersion.major_version; missing trailing parts are zero-filled.
+
+    :param version_string: A version string, such as "0.8.9" or "13.345"
+    :return: The parsed (major, minor, build) numbers
+    :rtype: typing.Tuple[int, int, int]
+    """
+    parts = [int(part) for part in version_string.split(".")]
+    if len(parts) > 1 and parts[0] == 0:
+        parts = parts[1:]
+    parts = (parts + [0, 0, 0])[:3]
+    return parts[0], parts[1], parts[2]
+
+
 class FoundryInstance(models.Model):
     instance_name = models.CharField(max_length=30, unique=True)
     instance_slug = models.CharField(
@@ -208,6 +227,82 @@ class FoundryInstance(models.Model):
 
     def delete_instance_folder(self):
         shutil.rmtree(self.data_path)
+        self.remove_release_overlay()
+
+    @property
+    def release_overlay_path(self) -> str:
+        return os.path.join(RELEASE_OVERLAY_PATH_BASE, self.instance_slug)
+
+    @property
+    def has_release_overlay(self) -> bool:
+        return (
+            foundry_interaction.release_overlay_version(self.release_overlay_path)
+            is not None
+        )
+
+    @property
+    def executable_path(self) -> str:
+        executable_path = self.foundry_version.executable_path
+        if self.has_release_overlay and executable_path != "false":
+            return os.path.join(
+                self.release_overlay_path,
+                os.path.relpath(executable_path, self.foundry_version.release_path),
+            )
+        return executable_path
+
+    def ensure_release_overlay(self):
+        """
+        Rebuilds the release overlay, if the instance has one, when it was built for a
+        different version; patched files don't carry over between versions.
+        """
+        overlay_version = foundry_interaction.release_overlay_version(
+            self.release_overlay_path
+        )
+        if overlay_version and overlay_version != self.foundry_version.version_string:
+            logging.warning(
+                f"rebuilding release overlay for {self.instance_name} on version {self.foundry_version.version_string}; patched files from {overlay_version} were dropped"
+            )
+            foundry_interaction.build_release_overlay(
+                self.foundry_version, self.release_overlay_path
+            )
+
+    @property
+    def public_path(self) -> str | None:
+        """The release's public directory as this instance's foundry sees it."""
+        public_path = self.foundry_version.public_path
+        if public_path and self.has_release_overlay:
+            return os.path.join(
+                self.release_overlay_path,
+                os.path.relpath(public_path, self.foundry_version.release_path),
+            )
+        return public_path
+
+    def patch_release_file(self, relative_path) -> str:
+        """Gets a writable, instance-only copy of a file in the instance's release tree.
+
+        The release overlay is created on first use; the shared release tree is never
+        modified.
+
+        :param relative_path: Path of the file, relative to the release root
+        :return: Path to the instance's copy of the file, which is safe to modify
+        :rtype: str
+        """
+        foundry_interaction.ensure_version_extracted(self.foundry_version)
+        if not self.has_release_overlay:
+            foundry_interaction.build_release_overlay(
+                self.foundry_version, self.release_overlay_path
+            )
+        return foundry_interaction.make_overlay_file_writable(
+            self.release_overlay_path, relative_path
+        )
+
+    def remove_release_overlay(self):
+        foundry_interaction.remove_release_overlay(self.release_overlay_path)
+
+    @property
+    def unix_socket_path(self) -> str:
+        # outside of Data, so backups and snapshots never come across it
+        return os.path.join(self.data_path, "foundry.sock")
 
     @property
     def user_facing_base_url(self) -> str:
@@ -356,6 +451,7 @@ class FoundryInstance(models.Model):
 
     def pre_activate(self, port) -> bool:
         foundry_interaction.ensure_version_extracted(self.foundry_version)
+        self.ensure_release_overlay()
         self.inject_config(port=port, clear_admin_pass=True)
         self.clear_unmatched_license()
         return self.assign_license_if_able()
@@ -503,40 +599,139 @@ class FoundryInstance(models.Model):
 
     @property
     def worlds(self) -> typing.List[dict]:
-        active_world_id = self.active_world_id
         worlds_path = os.path.join(self.data_path, "Data", "worlds")
-        all_worlds = []
-        if os.path.exists(worlds_path) and os.path.isdir(worlds_path):
-            for file_handle in os.listdir(worlds_path):
-                world_path = os.path.join(worlds_path, file_handle)
-                is_active_world = str(file_handle) == active_world_id
-                if os.path.isdir(world_path):
-                    world_json_path = os.path.join(world_path, "world.json")
-                    if os.path.exists(world_json_path) and os.path.isfile(
-                        world_json_path
-                    ):
-                        with open(world_json_path) as world_json:
-                            world_dict = json.load(world_json)
-                            world_dict["active"] = is_active_world
-                            if not world_dict.get("id"):
-                                world_dict["id"] = str(file_handle)
-                            all_worlds.append(world_dict)
-        return all_worlds
-
-    def get_level_db(self, world_id, database_name):
-        worlds_path = os.path.join(self.data_path, "Data", "worlds")
-        if os.path.exists(worlds_path) and os.path.isdir(worlds_path):
-            db_path = os.path.join(worlds_path, world_id, "data", database_name)
-            if os.path.exists(db_path):
-                return plyvel.DB(db_path)
-        return None
+        return world_data.world_catalogue(worlds_path).worlds(self.active_world_id)
+
+    @property
+    def snapshots(self) -> typing.List[dict]:
+        return backups.list_snapshots(self)
+
+    def queue_snapshot(self) -> str:
+        return RefractoryServer.get_server().run_in_background(
+            backups.snapshot_instance, self
+        )
+
+    def can_restore_snapshot(self, world_id=None) -> bool:
+        # foundry holds the active world's databases open, so it can't be restored under it
+        return not (
+            self.is_active and (not world_id or world_id == self.active_world_id)
+        )
+
+    def restore_snapshot(self, snapshot_id, world_id=None) -> bool:
+        if not self.can_restore_snapshot(world_id):
+            return False
+        return backups.restore_snapshot(self, snapshot_id, world_id=world_id)
+
+    def queue_snapshot_restore(self, snapshot_id, world_id=None) -> str:
+        # queued with activations, so the instance can't be started mid-restore
+        return RefractoryServer.get_server().queue_and_dispatch(
+            self.restore_snapshot, snapshot_id, world_id
+        )
+
+    @property
+    def uses_level_db(self) -> bool:
+        return bool(self.foundry_version) and self.version_tuple[0] >= 11
+
+    @property
+    def world_exports(self) -> typing.List[dict]:
+        return backups.list_world_exports(self)
+
+    def world_data_path(self, world_id) -> str:
+        return os.path.join(self.data_path, "Data", "worlds", world_id, "data")
+
+    def export_world(self, world_id, interrupt_players=False) -> str | None:
+        """Exports a world's databases consistently, even while it is running.
+
+        A running world is shut down for the export, since foundry holds its databases
+        open, and is relaunched afterwards.
+
+        :param world_id: The world to export
+        :param interrupt_players: Whether to go ahead if players are connected to the world
+        :return: The path of the export, or None if it couldn't be made
+        :rtype: str | None
+        """
+        if not self.uses_level_db:
+            return None
+        export_path = backups.new_world_export_path(self, world_id)
+        if not export_path:
+            return None
+        relaunch = self.is_active and self.active_world_id == world_id
+        if relaunch:
+            if self.has_active_players() and not interrupt_players:
+                return None
+            if not self.deactivate_world():
+                return None
+        try:
+            if relaunch and not self.wait_for_setup(WORLD_SHUTDOWN_TIMEOUT):
+                logging.error(
+                    f"world {world_id} of {self.instance_name} didn't shut down within {WORLD_SHUTDOWN_TIMEOUT}s, so it wasn't exported"
+                )
+                return None
+            backups.export_world_databases(self.world_data_path(world_id), export_path)
+        except Exception:
+            logging.exception(f"export of world {world_id} failed")
+            export_path = None
+        finally:
+            if relaunch:
+                self.activate_world(world_id)
+        return export_path
+
+    def wait_for_setup(self, timeout) -> bool:
+        """Waits for foundry to be back on its setup screen, after a world is shut down.
+
+        :param timeout: Seconds to wait at most
+        :return: Whether it got there in time
+        :rtype: bool
+        """
+        deadline = time.monotonic() + timeout
+        while self.instance_state != FoundryState.SETUP:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+        return True
+
+    def queue_world_export(self, world_id) -> str:
+        return RefractoryServer.get_server().run_in_background(
+            self.export_world, world_id
+        )
+
+    def can_restore_world_export(self, world_id) -> bool:
+        # foundry holds the active world's databases open
+        return self.uses_level_db and not (
+            self.is_active and self.active_world_id == world_id
+        )
+
+    def restore_world_export(self, world_id, export_id) -> bool:
+        if not self.can_restore_world_export(world_id):
+            return False
+        export_path = backups.world_export_path(self, world_id, export_id)
+        if not export_path or not os.path.exists(export_path):
+            return False
+        try:
+            backups.import_world_databases(self.world_data_path(world_id), export_path)
+        except (world_data.WorldDatabaseLocked, ValueError):
+            # raised on, so the task reports the failure
+            logging.exception(
+                f"couldn't restore world {world_id} of {self.instance_name} from {export_id}"
+            )
+            raise
+        return True
+
+    def queue_world_export_restore(self, world_id, export_id) -> str:
+        # queued with activations, so the world can't be launched mid-import
+        return RefractoryServer.get_server().queue_and_dispatch(
+            self.restore_world_export, world_id, export_id
+        )
+
+    def level_db_world(self, world_id) -> world_data.LevelDBWorld:
+        return world_data.LevelDBWorld(self, world_id)
 
     def get_nedb(self, world_id, database_name):
         worlds_path = os.path.join(self.data_path, "Data", "worlds")
         if os.path.exists(worlds_path) and os.path.isdir(worlds_path):
             db_path = os.path.join(worlds_path, world_id, "data", f"{database_name}.db")
             if os.path.exists(db_path):
-                return pathlib.Path(db_path)
+                return world_data.NeDBCollection(db_path)
         return None
 
     def inject_managed_gm_to_db(self, world_id):
@@ -563,22 +758,15 @@ class FoundryInstance(models.Model):
             try:
                 db = self.get_nedb(world_id, "users")
                 if db:
-                    lines = db.read_text().split("\n")
-                    lines.append(json.dumps(user_data))
-                    db.write_text("\n".join(lines))
+                    db.append([user_data])
                     return True
             except Exception:
                 pass
         else:
-            key, value = (
-                f"!users!{id}".encode("ascii"),
-                json.dumps(user_data).encode("ascii"),
-            )
             try:
-                db = self.get_level_db(world_id, "users")
-                if db:
-                    with db:
-                        db.put(key, value)
+                with self.level_db_world(world_id) as level_db_world:
+                    if level_db_world.exists("users"):
+                        level_db_world.put_documents("users", [user_data])
                 return True
             except Exception:
                 pass
@@ -690,6 +878,30 @@ class FoundryInstance(models.Model):
     def active_world_name(self) -> str:
         return self.get_join_info().get("world", {}).get("title")
 
+    def asset_path(self, asset_url_path) -> str | None:
+        """
+        Resolves a path as foundry serves it, such as a world background, to a file in
+        the instance's user data or its release's public directory.
+        """
+        relative_path = os.path.normpath(asset_url_path.split("?")[0].lstrip("/"))
+        if relative_path.startswith(".."):
+            return None
+        asset_roots = [os.path.join(self.data_path, "Data")]
+        # overlay-aware, so patched release files are the ones thumbnailed
+        public_path = self.public_path if self.foundry_version else None
+        if public_path:
+            asset_roots.append(public_path)
+        for asset_root in asset_roots:
+            candidate_path = os.path.join(asset_root, relative_path)
+            if os.path.isfile(candidate_path):
+                return candidate_path
+        return None
+
+    def background_thumbnail_url(self, background) -> str | None:
+        if not background:
+            return None
+        return thumbnails.thumbnail_url(self.asset_path(background))
+
     @property
     def active_background_url(self) -> str:
         join_info = self.get_join_info()
@@ -700,7 +912,10 @@ class FoundryInstance(models.Model):
             )
             join_bg = join_bg_legacy
         if join_bg:
-            return f"{self.user_facing_base_url}/{join_bg}"
+            return (
+                self.background_thumbnail_url(join_bg)
+                or f"{self.user_facing_base_url}/{join_bg}"
+            )
         else:
             return static_url("refractory/img/ActiveWorld.png")
 
@@ -806,6 +1021,31 @@ class FoundryVersion(models.Model):
         choices=DownloadStatus.choices,
         default=DownloadStatus.NOT_DOWNLOADED,
     )
+    download_progress = models.PositiveSmallIntegerField(
+        default=0, editable=False, help_text="Download progress percentage"
+    )
+    # Parsed from version_string on save, so ordering and major version filtering can happen in the database
+    version_major = models.IntegerField(default=0, editable=False)
+    version_minor = models.IntegerField(default=0, editable=False)
+    version_build = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["version_major", "version_minor", "version_build"],
+                name="foundryversion_version_idx",
+            )
+        ]
+
+    def save(self, *args, **kwargs):
+        try:
+            self.version_major, self.version_minor, self.version_build = (
+                parse_version_numbers(self.version_string)
+            )
+        except ValueError:
+            # not a numeric version; it sorts as 0.0.0, the same as in the migration
+            self.version_major, self.version_minor, self.version_build = 0, 0, 0
+        super().save(*args, **kwargs)
 
     @property
     def version_download_string(self):
@@ -820,6 +1060,10 @@ class FoundryVersion(models.Model):
     def version_tuple(self):
         return tuple([int(version) for version in self.version_string.split(".")])
 
+    @property
+    def release_path(self) -> str:
+        return os.path.join(RELEASE_PATH_BASE, self.version_string)
+
     @property
     def node_app_root(self) -> str | None:
         electron_ver_path = os.path.join(
@@ -831,6 +1075,13 @@ class FoundryVersion(models.Model):
                 return candidate_path
         return None
 
+    @property
+    def public_path(self) -> str | None:
+        node_app_root = self.node_app_root
+        if node_app_root:
+            return os.path.join(node_app_root, "public")
+        return None
+
     @property
     def executable_path(self) -> str:
         electron_ver_path = os.path.join(
@@ -850,8 +1101,51 @@ class FoundryVersion(models.Model):
     def __str__(self) -> str:
         return self.version_string
 
-    def download_version(self, foundry_session_id):
-        foundry_interaction.download_single_release(self, foundry_session_id)
+    def download_version(self, foundry_session_id, progress_callback=None):
+        foundry_interaction.download_single_release(
+            self, foundry_session_id, progress_callback=progress_callback
+        )
+
+    def queue_download(self, foundry_session_id) -> str:
+        """Starts downloading this version in the background.
+
+        Byte-level progress is reported to the task system under the returned task id,
+        and the download percentage is kept up to date in download_progress.
+
+        :param foundry_session_id: The foundry site session id to download with
+        :return: The id of the download task
+        :rtype: str
+        """
+        server = RefractoryServer.get_server()
+        task_id = str(uuid.uuid4())
+        self.download_status = FoundryVersion.DownloadStatus.DOWNLOADING
+        self.download_progress = 0
+        self.save()
+
+        def report_progress(bytes_done, bytes_total, bytes_per_second):
+            server.task_queue.set_task_progress(
+                task_id,
+                {
+                    "bytes_done": bytes_done,
+                    "bytes_total": bytes_total,
+                    "bytes_per_second": int(bytes_per_second),
+                },
+            )
+            if bytes_total:
+                percent = min(100, bytes_done * 100 // bytes_total)
+                if percent != self.download_progress:
+                    self.download_progress = percent
+                    FoundryVersion.objects.filter(pk=self.pk).update(
+                        download_progress=percent
+                    )
+
+        server.run_in_background(
+            self.download_version,
+            foundry_session_id,
+            report_progress,
+            task_id=task_id,
+        )
+        return task_id
 
     @classmethod
     def download_from_timed_url(cls, timed_url):
@@ -885,17 +1179,15 @@ class FoundryLicense(models.Model):
     def find_free_if_available(
         cls,
     ) -> "typing.Tuple[FoundryLicense | None, FoundryInstance | None]":
-        active_instance_names = (
-            RefractoryServer.get_server().get_active_instance_names()
-        )
+        license_holder_names = RefractoryServer.get_server().get_license_holder_names()
         free_licenses = cls.objects.exclude(
-            instance__instance_name__in=active_instance_names
+            instance__instance_name__in=license_holder_names
         )
         if free_licenses.exists():
             return free_licenses.first(), None
         else:
             available_instances = []
-            for instance_name in active_instance_names:
+            for instance_name in license_holder_names:
                 try:
                     instance = FoundryInstance.objects.get(instance_name=instance_name)
                     if not instance.has_active_players():
@@ -906,18 +1198,17 @@ class FoundryLicense(models.Model):
 
     @classmethod
     def load_from_foundry_account(cls, foundry_session, foundry_username):
-        with requests.Session() as rsession:
-            rsession.cookies.update({"sessionid": foundry_session})
-            licenses = foundry_interaction.get_licenses(rsession, foundry_username)
-            for license_ix, license_obj in enumerate(licenses):
-                license_key = license_obj.get("license_key")
-                license_name = license_obj.get("license_name", "").strip()
-                if not license_name:
-                    license_name = f"{foundry_username} License {license_ix + 1}"
-                if not FoundryLicense.objects.filter(license_key=license_key).exists():
-                    FoundryLicense(
-                        license_key=license_key, license_name=license_name
-                    ).save()
+        rsession = foundry_interaction.get_site_session(foundry_session)
+        licenses = foundry_interaction.get_licenses(rsession, foundry_username)
+        for license_ix, license_obj in enumerate(licenses):
+            license_key = license_obj.get("license_key")
+            license_name = license_obj.get("license_name", "").strip()
+            if not license_name:
+                license_name = f"{foundry_username} License {license_ix + 1}"
+            if not FoundryLicense.objects.filter(license_key=license_key).exists():
+                FoundryLicense(
+                    license_key=license_key, license_name=license_name
+                ).save()
 
     def get_absolute_url(self):
         return reverse("license_update", kwargs={"id": self.id})
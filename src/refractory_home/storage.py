@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import os
+
+from django.contrib.staticfiles.storage import StaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {
+    ".css",
+    ".js",
+    ".map",
+    ".json",
+    ".svg",
+    ".html",
+    ".txt",
+    ".xml",
+    ".ico",
+    ".ttf",
+    ".otf",
+    ".eot",
+}
+# Below this, a compressed copy isn't worth the extra request header handling
+MIN_COMPRESS_SIZE = 512
+VERSION_HASH_LENGTH = 12
+
+
+def _write_compressed(path, suffix, data):
+    compressed_path = f"{path}{suffix}"
+    with open(f"{compressed_path}.tmp", "wb") as compressed_file:
+        compressed_file.write(data)
+    os.replace(f"{compressed_path}.tmp", compressed_path)
+    # keeps the variant from looking stale next to its source
+    source_stat = os.stat(path)
+    os.utime(compressed_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+
+def compress_static_file(path) -> list:
+    """Writes .gz, and with brotli installed .br, variants of a static file.
+
+    :return: The suffixes of the variants written
+    :rtype: list
+    """
+    with open(path, "rb") as source_file:
+        data = source_file.read()
+    written = []
+    variants = [(".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli:
+        variants.append((".br", lambda: brotli.compress(data)))
+    for suffix, compress in variants:
+        compressed = compress()
+        if len(compressed) < len(data):
+            _write_compressed(path, suffix, compressed)
+            written.append(suffix)
+    return written
+
+
+class VersionedStaticFilesStorage(StaticFilesStorage):
+    """
+    Static files storage that adds a content hash to each file's URL as ?v=, so they can
+    be cached indefinitely by browsers, and writes compressed variants of text files
+    during collectstatic for the twisted static resource to serve.
+
+    The hash is a query argument rather than part of the file name because the portal's
+    own files live in STATIC_ROOT rather than being collected into it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # name -> ((mtime, size), version hash)
+        self._versions = {}
+
+    def file_version(self, name) -> str | None:
+        try:
+            path = self.path(name)
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._versions.get(name)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with open(path, "rb") as static_file:
+            version = hashlib.sha256(static_file.read()).hexdigest()
+        version = version[:VERSION_HASH_LENGTH]
+        self._versions[name] = (stamp, version)
+        return version
+
+    def url(self, name):
+        url = super().url(name)
+        version = self.file_version(name.split("?")[0].lstrip("/"))
+        if version and "?" not in url:
+            url = f"{url}?v={version}"
+        return url
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        for root, _, files in os.walk(self.location):
+            for file_name in files:
+                if os.path.splitext(file_name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, file_name)
+                if os.path.getsize(path) < MIN_COMPRESS_SIZE:
+                    continue
+                name = os.path.relpath(path, self.location).replace(os.sep, "/")
+                for suffix in compress_static_file(path):
+                    yield name, f"{name}{suffix}", True
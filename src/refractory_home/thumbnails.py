@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+LOGGER = logging.getLogger("thumbnails")
+
+THUMBNAIL_PATH_BASE = "world_thumbnails"
+# Served by RefractoryServer, outside of django, at /<THUMBNAIL_URL_PATH>/<name>
+THUMBNAIL_URL_PATH = "thumbnails"
+# Twice the size of a world card, for high density displays
+THUMBNAIL_SIZE = (960, 400)
+THUMBNAIL_QUALITY = 80
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Content hashes remembered, most recently used last
+MAX_CACHED_HASHES = 1024
+# Thumbnails that no world card has asked for in this long are removed by pruning
+THUMBNAIL_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+# How stale a thumbnail's mtime may get before a request refreshes it
+THUMBNAIL_TOUCH_SECONDS = 24 * 60 * 60
+THUMBNAIL_PRUNE_INTERVAL_SECONDS = 24 * 60 * 60
+THUMBNAIL_LOCK_COUNT = 16
+
+# (path, mtime, size) -> sha256 of the file, so unchanged backgrounds aren't re-read
+_content_hashes = collections.OrderedDict()
+_content_hashes_lock = threading.Lock()
+# Thumbnails are locked by their name's hash, so different images are made in parallel
+_thumbnail_locks = [threading.Lock() for _ in range(THUMBNAIL_LOCK_COUNT)]
+
+
+def _content_hash(source_path) -> str:
+    stat = os.stat(source_path)
+    key = (os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size)
+    with _content_hashes_lock:
+        if key in _content_hashes:
+            _content_hashes.move_to_end(key)
+            return _content_hashes[key]
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source_file:
+        while chunk := source_file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    with _content_hashes_lock:
+        _content_hashes[key] = digest.hexdigest()
+        while len(_content_hashes) > MAX_CACHED_HASHES:
+            _content_hashes.popitem(last=False)
+    return digest.hexdigest()
+
+
+def _write_thumbnail(source_path, thumbnail_path):
+    with Image.open(source_path) as image:
+        # lets JPEG decoding skip straight to a smaller scale
+        image.draft("RGB", THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE)
+        os.makedirs(THUMBNAIL_PATH_BASE, exist_ok=True)
+        image.convert("RGB").save(
+            f"{thumbnail_path}.tmp", "JPEG", quality=THUMBNAIL_QUALITY, optimize=True
+        )
+    os.replace(f"{thumbnail_path}.tmp", thumbnail_path)
+
+
+def thumbnail_url(source_path) -> str | None:
+    """Returns the URL of a card sized thumbnail of an image, generating it if needed.
+
+    Thumbnails are named by the content hash of their source, so they can be cached by
+    browsers indefinitely.
+
+    :param source_path: Path to the full size image
+    :return: The thumbnail's URL, or None if Pillow isn't installed or the image can't be read
+    :rtype: str | None
+    """
+    if Image is None or not source_path:
+        return None
+    try:
+        content_hash = _content_hash(source_path)
+        thumbnail_name = f"{content_hash}.jpg"
+        thumbnail_path = os.path.join(THUMBNAIL_PATH_BASE, thumbnail_name)
+        with _thumbnail_locks[int(content_hash[:8], 16) % THUMBNAIL_LOCK_COUNT]:
+            if not os.path.exists(thumbnail_path):
+                _write_thumbnail(source_path, thumbnail_path)
+            elif (
+                time.time() - os.stat(thumbnail_path).st_mtime > THUMBNAIL_TOUCH_SECONDS
+            ):
+                # marks it as still in use, for prune_thumbnails
+                os.utime(thumbnail_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as ex:
+        LOGGER.warning(f"couldn't thumbnail {source_path}: {ex}")
+        return None
+    return f"/{THUMBNAIL_URL_PATH}/{thumbnail_name}"
+
+
+def prune_thumbnails(max_age_seconds=THUMBNAIL_MAX_AGE_SECONDS) -> int:
+    """Removes thumbnails that haven't been asked for in max_age_seconds.
+
+    A thumbnail still in use is made again on its next request, so pruning is always
+    safe; browsers that cached it keep their copy.
+
+    :return: The number of thumbnails removed
+    :rtype: int
+    """
+    if not os.path.isdir(THUMBNAIL_PATH_BASE):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for file_name in os.listdir(THUMBNAIL_PATH_BASE):
+        file_path = os.path.join(THUMBNAIL_PATH_BASE, file_name)
+        try:
+            if os.stat(file_path).st_mtime < cutoff:
+                os.remove(file_path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        LOGGER.info(f"pruned {removed} unused thumbnails")
+    return removed
@@ -19,6 +19,7 @@ from .views import (
     ConfirmSetupView,
     ActivateInstance,
     ActivateWorld,
+    InstanceWorldListView,
     DownloadInstanceBackup,
     DownloadVersion,
     InstanceLoginView,
@@ -34,6 +35,13 @@ from .views import (
     InviteListView,
     InviteUpdateView,
     InviteDeleteView,
+    TaskStatusView,
+    InstanceSnapshotListView,
+    TakeInstanceSnapshot,
+    RestoreInstanceSnapshot,
+    DownloadInstanceSnapshot,
+    ExportInstanceWorld,
+    RestoreInstanceWorldExport,
 )
 
 urlpatterns = [
@@ -51,6 +59,7 @@ urlpatterns = [
         name="foundry_site_login",
     ),
     path("panel/", PanelView.as_view(), name="panel"),
+    path("tasks/<str:task_id>/", TaskStatusView.as_view(), name="task_status"),
     path(
         "instances/<slug:instance_slug>/vtt_login/",
         InstanceLoginView.as_view(),
@@ -103,6 +112,11 @@ urlpatterns = [
     #     InstanceManagedGMLogin.as_view(),
     #     name="managed_admin_login",
     # ),
+    path(
+        "instances/<slug:instance_slug>/worlds/",
+        InstanceWorldListView.as_view(),
+        name="instance_worlds",
+    ),
     path(
         "instances/<slug:instance_slug>/activate/<slug:world_id>/",
         ActivateWorld.as_view(),
@@ -125,6 +139,36 @@ urlpatterns = [
         DownloadInstanceBackup.as_view(),
         name="instance_download_backup",
     ),
+    path(
+        "instances/<slug:instance_slug>/snapshots/",
+        InstanceSnapshotListView.as_view(),
+        name="instance_snapshots",
+    ),
+    path(
+        "instances/<slug:instance_slug>/snapshots/take/",
+        TakeInstanceSnapshot.as_view(),
+        name="instance_snapshot_take",
+    ),
+    path(
+        "instances/<slug:instance_slug>/snapshots/<str:snapshot_id>/restore/",
+        RestoreInstanceSnapshot.as_view(),
+        name="instance_snapshot_restore",
+    ),
+    path(
+        "instances/<slug:instance_slug>/snapshots/<str:snapshot_id>/download/",
+        DownloadInstanceSnapshot.as_view(),
+        name="instance_snapshot_download",
+    ),
+    path(
+        "instances/<slug:instance_slug>/world_exports/take/",
+        ExportInstanceWorld.as_view(),
+        name="instance_world_export_take",
+    ),
+    path(
+        "instances/<slug:instance_slug>/world_exports/<str:world_id>/<str:export_id>/restore/",
+        RestoreInstanceWorldExport.as_view(),
+        name="instance_world_export_restore",
+    ),
     path(
         "versions/",
         VersionListView.as_view(),
@@ -1,9 +1,6 @@
 from functools import cached_property
 import logging
 import os
-import zipfile
-from io import BytesIO
-from pathlib import Path
 from wsgiref.util import FileWrapper
 
 from django import forms
@@ -17,7 +14,13 @@ from django.contrib.auth.models import Group
 from django.contrib.auth.views import LoginView
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import redirect, render, resolve_url
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
@@ -37,7 +40,7 @@ from django.views.generic import (
 from django.views.generic.edit import FormView
 from django_ratelimit.decorators import ratelimit
 
-from refractory_home import common_tasks
+from refractory_home import backups, common_tasks
 from refractory_home.models import (
     FoundryInstance,
     FoundryState,
@@ -51,6 +54,7 @@ from web_interaction.foundry_interaction import (
     FOUNDRY_SESSION_COOKIE,
     foundry_site_login,
 )
+from web_server import RefractoryServer
 
 #
 # Access Control
@@ -117,9 +121,13 @@ def get_confirm_delete_form(
 #
 # Task Stuff
 #
-class TaskStatusView(View):
-    def get(self, request, request_id, **kwargs):
-        return HttpResponse("DNE")
+class TaskStatusView(LoginRequiredMixin, View):
+    def get(self, request, *args, task_id="", **kwargs):
+        task_queue = RefractoryServer.get_server().task_queue
+        progress = task_queue.progress(task_id)
+        return JsonResponse(
+            {"status": task_queue.status(task_id), "progress": progress}
+        )
 
 
 #
@@ -136,6 +144,56 @@ class PanelView(LoginRequiredMixin, TemplateView):
         return context
 
 
+class InstanceWorldListView(LoginRequiredMixin, View):
+    """Pages of the world cards for one instance, loaded by the panel as they scroll in."""
+
+    paginate_by = 12
+    max_paginate_by = 48
+
+    def world_summary(self, instance, world) -> dict:
+        summary = {
+            "id": world["id"],
+            "title": world.get("title") or world["id"],
+            "active": world["active"],
+            "instance_name": instance.display_name,
+        }
+        if world["active"]:
+            summary["background_url"] = instance.active_background_url
+            summary["action_url"] = instance.user_facing_base_url
+            summary["player_count"] = instance.active_player_count
+        else:
+            summary["background_url"] = (
+                instance.background_thumbnail_url(world.get("background"))
+                or instance.default_background_url
+            )
+            summary["action_url"] = reverse(
+                "activate_world", args=[instance.instance_slug, world["id"]]
+            )
+        return summary
+
+    def get(self, request, *args, instance_slug="", **kwargs):
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+        except FoundryInstance.DoesNotExist:
+            raise PermissionDenied
+        if not instance.user_can_view(request.user):
+            raise PermissionDenied
+        try:
+            per_page = int(request.GET.get("per_page", self.paginate_by))
+        except ValueError:
+            per_page = self.paginate_by
+        per_page = min(max(per_page, 1), self.max_paginate_by)
+        page = Paginator(instance.worlds, per_page).get_page(request.GET.get("page"))
+        return JsonResponse(
+            {
+                "worlds": [self.world_summary(instance, world) for world in page],
+                "page": page.number,
+                "num_pages": page.paginator.num_pages,
+                "next_page": page.next_page_number() if page.has_next() else None,
+            }
+        )
+
+
 #
 # Version Managment
 #
@@ -145,24 +203,26 @@ class MajorVersionPaginator(Paginator):
     def page(self, number):
         """Return a Page object for the given 1-based page number."""
         number = self.validate_number(number)
+        if not self.major_versions:
+            return self._get_page(self.object_list.none(), number, self)
         return self._get_page(
-            [
-                ver
-                for ver in self.object_list
-                if ver.major_version == self.major_versions[number - 1]
-            ],
+            self.object_list.filter(version_major=self.major_versions[number - 1]),
             number,
             self,
         )
 
     @cached_property
     def major_versions(self):
-        return sorted(
-            list(set([ver.major_version for ver in self.object_list])), reverse=True
+        return list(
+            self.object_list.order_by("-version_major")
+            .values_list("version_major", flat=True)
+            .distinct()
         )
 
     @cached_property
     def num_pages(self):
+        if not self.major_versions and self.allow_empty_first_page:
+            return 1
         return len(self.major_versions)
 
 
@@ -171,7 +231,7 @@ class VersionListView(SuperuserRequiredMixin, FoundryVTTLoginContextMixin, ListV
     paginator_class = MajorVersionPaginator
     paginate_by = 100
     template_name = "version_list.html"
-    ordering = ["version_string"]
+    ordering = ["-version_major", "-version_minor", "-version_build"]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -180,26 +240,28 @@ class VersionListView(SuperuserRequiredMixin, FoundryVTTLoginContextMixin, ListV
 
     def get_queryset(self):
         common_tasks.load_foundry_releases()
-        qs = super().get_queryset()
-        return list(reversed(sorted(qs, key=lambda n: (n.version_tuple))))
+        return super().get_queryset()
 
 
 class DownloadVersion(View, FoundrySiteInteractionRequiredMixin):
     def post(self, request, *args, version_string="", **kwargs):
+        params = None
         try:
             foundry_username, foundry_session_id = self.get_foundry_site_info()
             foundry_version = FoundryVersion.objects.get(version_string=version_string)
-            foundry_version.download_version(foundry_session_id)
+            task_id = foundry_version.queue_download(foundry_session_id)
+            params = {"task_id": task_id, "version": version_string}
             messages.info(
                 request,
-                _("Downloaded Version %s (Build %s) successfully.")
+                _("Downloading Version %s (Build %s).")
                 % (foundry_version.version_string, foundry_version.build),
             )
         except FoundryVersion.DoesNotExist:
             messages.error(request, _("Bad Version String"))
         except Exception as ex:
             raise ex
-        return redirect(reverse("version_list"))
+        redir_url = instrument_url_with_params(reverse("version_list"), params=params)
+        return redirect(redir_url)
 
 
 #
@@ -646,29 +708,150 @@ class DownloadInstanceBackup(View, SuperuserRequiredMixin):
     def post(self, request, *args, instance_slug="", **kwargs):
         try:
             instance = FoundryInstance.objects.get(instance_slug=instance_slug)
-            buf = BytesIO()
-
-            archive = zipfile.ZipFile(buf, "w")
-            with buf:
-                whitelist_path = Path(os.path.join(instance.data_path, "Data"))
-                for root, dirs, files in os.walk(instance.data_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        if whitelist_path in Path(file_path).parents:
-                            archive.write(file_path, os.path.relpath(file_path))
-                archive.close()
-                resp = HttpResponse(
-                    buf.getvalue(), content_type="application/x-zip-compressed"
+            try:
+                compress_level = int(request.POST.get("compress_level", 0))
+            except ValueError:
+                compress_level = 0
+            if compress_level not in backups.BACKUP_COMPRESS_LEVELS:
+                compress_level = 0
+            resp = StreamingHttpResponse(
+                backups.stream_instance_backup(instance, compress_level=compress_level),
+                content_type="application/x-zip-compressed",
+            )
+            resp["Content-Disposition"] = (
+                "attachment; filename=refractory_backup_%s.zip" % instance_slug
+            )
+            return resp
+        except FoundryInstance.DoesNotExist:
+            messages.error(request, _("Instance does not exist."))
+            return redirect(reverse("panel"))
+
+
+class InstanceSnapshotListView(SuperuserRequiredMixin, DetailView):
+    model = FoundryInstance
+    template_name = "snapshot_list.html"
+    slug_field = "instance_slug"
+    slug_url_kwarg = "instance_slug"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["snapshots"] = self.object.snapshots
+        if self.object.uses_level_db:
+            context["worlds"] = self.object.worlds
+            context["world_exports"] = self.object.world_exports
+        return context
+
+
+class TakeInstanceSnapshot(SuperuserRequiredMixin, View):
+    def post(self, request, *args, instance_slug="", **kwargs):
+        params = None
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+            task_id = instance.queue_snapshot()
+            params = {"task_id": task_id}
+            messages.info(request, _("Taking snapshot."))
+        except FoundryInstance.DoesNotExist:
+            messages.error(request, _("Instance does not exist."))
+            return redirect(reverse("panel"))
+        redir_url = instrument_url_with_params(
+            reverse("instance_snapshots", args=[instance_slug]), params=params
+        )
+        return redirect(redir_url)
+
+
+class RestoreInstanceSnapshot(SuperuserRequiredMixin, View):
+    def post(self, request, *args, instance_slug="", snapshot_id="", **kwargs):
+        params = None
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+            world_id = request.POST.get("world_id") or None
+            manifest = backups.load_snapshot(instance, snapshot_id)
+            if not manifest:
+                messages.error(request, _("Snapshot does not exist."))
+            elif world_id and not backups.snapshot_has_world(manifest, world_id):
+                messages.error(request, _("That world isn't in the snapshot."))
+            elif not instance.can_restore_snapshot(world_id):
+                messages.error(
+                    request,
+                    _("Couldn't restore snapshot; the world is active."),
+                )
+            else:
+                task_id = instance.queue_snapshot_restore(snapshot_id, world_id)
+                params = {"task_id": task_id}
+                messages.info(request, _("Restoring snapshot %s.") % snapshot_id)
+        except FoundryInstance.DoesNotExist:
+            messages.error(request, _("Instance does not exist."))
+            return redirect(reverse("panel"))
+        redir_url = instrument_url_with_params(
+            reverse("instance_snapshots", args=[instance_slug]), params=params
+        )
+        return redirect(redir_url)
+
+
+class DownloadInstanceSnapshot(SuperuserRequiredMixin, View):
+    def post(self, request, *args, instance_slug="", snapshot_id="", **kwargs):
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+            archive = backups.stream_snapshot_zip(instance, snapshot_id)
+            if archive:
+                resp = StreamingHttpResponse(
+                    archive, content_type="application/x-zip-compressed"
                 )
                 resp["Content-Disposition"] = (
-                    "attachment; filename=refractory_backup_%s.zip" % instance_slug
+                    "attachment; filename=refractory_snapshot_%s_%s.zip"
+                    % (instance_slug, snapshot_id)
                 )
                 return resp
+            messages.error(request, _("Snapshot does not exist."))
+            return redirect(reverse("instance_snapshots", args=[instance_slug]))
         except FoundryInstance.DoesNotExist:
             messages.error(request, _("Instance does not exist."))
             return redirect(reverse("panel"))
-        messages.error(request, _("Download failed."))
-        return redirect(reverse("panel"))
+
+
+class ExportInstanceWorld(SuperuserRequiredMixin, View):
+    def post(self, request, *args, instance_slug="", **kwargs):
+        params = None
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+            task_id = instance.queue_world_export(request.POST.get("world_id", ""))
+            params = {"task_id": task_id}
+            messages.info(request, _("Exporting world databases."))
+        except FoundryInstance.DoesNotExist:
+            messages.error(request, _("Instance does not exist."))
+            return redirect(reverse("panel"))
+        redir_url = instrument_url_with_params(
+            reverse("instance_snapshots", args=[instance_slug]), params=params
+        )
+        return redirect(redir_url)
+
+
+class RestoreInstanceWorldExport(SuperuserRequiredMixin, View):
+    def post(
+        self, request, *args, instance_slug="", world_id="", export_id="", **kwargs
+    ):
+        params = None
+        try:
+            instance = FoundryInstance.objects.get(instance_slug=instance_slug)
+            export_path = backups.world_export_path(instance, world_id, export_id)
+            if not export_path or not os.path.exists(export_path):
+                messages.error(request, _("Export does not exist."))
+            elif not instance.can_restore_world_export(world_id):
+                messages.error(
+                    request,
+                    _("Couldn't restore world; the world is active."),
+                )
+            else:
+                task_id = instance.queue_world_export_restore(world_id, export_id)
+                params = {"task_id": task_id}
+                messages.info(request, _("Restoring world %s.") % world_id)
+        except FoundryInstance.DoesNotExist:
+            messages.error(request, _("Instance does not exist."))
+            return redirect(reverse("panel"))
+        redir_url = instrument_url_with_params(
+            reverse("instance_snapshots", args=[instance_slug]), params=params
+        )
+        return redirect(redir_url)
 
 
 class ManagedUserCreationForm(forms.Form):
@@ -0,0 +1,393 @@
+import json
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+
+import plyvel
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class WorldDatabaseLocked(Exception):
+    """
+    Raised when a world's databases are held by foundry, which locks them while the world
+    is running.
+    """
+
+
+# Databases opened by this process, by path, as [db, number of users]. LevelDB only
+# allows one handle per database per process, so concurrent users share it.
+_open_level_dbs = {}
+_open_level_dbs_lock = threading.Lock()
+
+
+@contextmanager
+def open_level_db(db_path, create_if_missing=False):
+    """Opens a LevelDB database, sharing the handle with other users in this process.
+
+    The handle is closed once its last user is done, so that foundry can take the
+    database's LOCK file again when it launches the world.
+
+    :param db_path: Path to the database directory
+    :param create_if_missing: Whether to create the database if it doesn't exist
+    :raises WorldDatabaseLocked: If another process, usually foundry, holds the database
+    """
+    db_path = os.path.abspath(db_path)
+    with _open_level_dbs_lock:
+        if db_path in _open_level_dbs:
+            _open_level_dbs[db_path][1] += 1
+        else:
+            try:
+                db = plyvel.DB(db_path, create_if_missing=create_if_missing)
+            except plyvel.IOError as ex:
+                if "lock" in str(ex).lower():
+                    raise WorldDatabaseLocked(f"{db_path} is in use") from ex
+                raise
+            _open_level_dbs[db_path] = [db, 1]
+        db = _open_level_dbs[db_path][0]
+    try:
+        yield db
+    finally:
+        with _open_level_dbs_lock:
+            _open_level_dbs[db_path][1] -= 1
+            if _open_level_dbs[db_path][1] == 0:
+                _open_level_dbs.pop(db_path)[0].close()
+
+
+def document_key(collection, document_id) -> bytes:
+    return f"!{collection}!{document_id}".encode("ascii")
+
+
+class LevelDBWorld:
+    """
+    Access to the LevelDB document collections of a v11+ world, such as users or actors.
+
+    Used as a context manager, the world holds each collection's handle from its first
+    use until the block ends, so a batch of operations opens every collection once.
+    Outside of one, every operation opens the collection for its own duration only.
+    """
+
+    def __init__(self, instance, world_id):
+        self.instance = instance
+        self.world_id = world_id
+        self.data_path = instance.world_data_path(world_id)
+        # collection -> handle, while used as a context manager
+        self._held = None
+        self._exit_stack = None
+
+    def __enter__(self):
+        self.check_unlocked()
+        self._exit_stack = ExitStack()
+        self._held = {}
+        return self
+
+    def __exit__(self, *exc_info):
+        exit_stack, self._exit_stack, self._held = self._exit_stack, None, None
+        return exit_stack.__exit__(*exc_info)
+
+    def _check_not_running(self):
+        if self.instance.is_active and self.instance.active_world_id == self.world_id:
+            raise WorldDatabaseLocked(f"world {self.world_id} is running")
+
+    def check_unlocked(self):
+        """
+        :raises WorldDatabaseLocked: If the world is running, or foundry still holds any
+            of its collections, as it does while the world is closing
+        """
+        self._check_not_running()
+        for collection in self.collections():
+            if collection not in (self._held or {}):
+                # opening fails while another process has the database's LOCK file
+                with open_level_db(self.collection_path(collection)):
+                    pass
+
+    def collection_path(self, collection) -> str:
+        if os.path.basename(collection) != collection:
+            raise ValueError(f"bad collection name {collection}")
+        return os.path.join(self.data_path, collection)
+
+    def exists(self, collection) -> bool:
+        return os.path.isfile(os.path.join(self.collection_path(collection), "CURRENT"))
+
+    def collections(self) -> list:
+        if not os.path.isdir(self.data_path):
+            return []
+        return sorted(name for name in os.listdir(self.data_path) if self.exists(name))
+
+    @contextmanager
+    def open(self, collection, create_if_missing=False):
+        if self._held is not None and collection in self._held:
+            yield self._held[collection]
+            return
+        self._check_not_running()
+        db_context = open_level_db(
+            self.collection_path(collection), create_if_missing=create_if_missing
+        )
+        if self._held is not None:
+            self._held[collection] = self._exit_stack.enter_context(db_context)
+            yield self._held[collection]
+            return
+        with db_context as db:
+            yield db
+
+    def put_many(self, collection, items, sync=True) -> int:
+        """Writes (key, value) pairs in a single write batch.
+
+        :return: The number of pairs written
+        :rtype: int
+        """
+        count = 0
+        with self.open(collection) as db:
+            with db.write_batch(sync=sync) as batch:
+                for key, value in items:
+                    batch.put(key, value)
+                    count += 1
+        return count
+
+    def delete_many(self, collection, keys, sync=True) -> int:
+        count = 0
+        with self.open(collection) as db:
+            with db.write_batch(sync=sync) as batch:
+                for key in keys:
+                    batch.delete(key)
+                    count += 1
+        return count
+
+    def iterate(self, collection, prefix=None):
+        """
+        Yields (key, value) pairs from a snapshot of a collection, so the results are
+        consistent even if the collection is written to while iterating.
+        """
+        with self.open(collection) as db:
+            with db.snapshot() as snapshot:
+                for key, value in snapshot.iterator(prefix=prefix):
+                    yield key, value
+
+    def put_documents(self, collection, documents) -> int:
+        """Writes foundry documents, keyed by their _id, in a single write batch.
+
+        :param collection: The collection, such as "users"
+        :param documents: Document dicts, each with an _id
+        :return: The number of documents written
+        :rtype: int
+        """
+        return self.put_many(
+            collection,
+            (
+                (
+                    document_key(collection, document["_id"]),
+                    json.dumps(document).encode(),
+                )
+                for document in documents
+            ),
+        )
+
+    def iter_documents(self, collection):
+        for key, value in self.iterate(collection, prefix=document_key(collection, "")):
+            yield json.loads(value)
+
+
+NEDB_READ_CHUNK_SIZE = 64 * 1024
+
+
+class NeDBCollection:
+    """
+    A pre-v11 world collection, such as users.db, in NeDB's append-only format: one JSON
+    document per line, where later lines replace earlier ones with the same _id.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _needs_separator(self) -> bool:
+        # foundry doesn't always end the file with a newline
+        with open(self.db_path, "rb") as db_file:
+            db_file.seek(0, os.SEEK_END)
+            if db_file.tell() == 0:
+                return False
+            db_file.seek(-1, os.SEEK_END)
+            return db_file.read(1) != b"\n"
+
+    def append(self, documents) -> int:
+        """Appends documents with a single O_APPEND write, synced to disk before returning.
+
+        :param documents: Document dicts, each with an _id
+        :return: The number of documents appended
+        :rtype: int
+        """
+        lines = [json.dumps(document) for document in documents]
+        if not lines:
+            return 0
+        data = "".join(f"{line}\n" for line in lines).encode()
+        if self._needs_separator():
+            data = b"\n" + data
+        fd = os.open(self.db_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return len(lines)
+
+    def iter_lines(self):
+        """Yields the non-empty lines of the collection, reading it in chunks."""
+        with open(self.db_path, "rb") as db_file:
+            remainder = b""
+            while chunk := db_file.read(NEDB_READ_CHUNK_SIZE):
+                lines = (remainder + chunk).split(b"\n")
+                remainder = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield line
+            if remainder.strip():
+                yield remainder
+
+    def iter_documents(self):
+        """Yields every parsed line, including superseded documents and deletions."""
+        for line in self.iter_lines():
+            yield json.loads(line)
+
+    def compact(self) -> int:
+        """Rewrites the collection with only the latest version of each live document.
+
+        Only the byte offsets of each document's latest line are held in memory. The
+        world must not be running, since foundry keeps its own copy of the collection.
+
+        :return: The number of documents kept
+        :rtype: int
+        """
+        latest = {}
+        index_lines = []
+        offset = 0
+        with open(self.db_path, "rb") as db_file:
+            for line in db_file:
+                if line.strip():
+                    document = json.loads(line)
+                    if "$$indexCreated" in document:
+                        index_lines.append(offset)
+                    elif document.get("$$deleted"):
+                        latest.pop(document["_id"], None)
+                    else:
+                        latest[document["_id"]] = offset
+                offset += len(line)
+            compact_path = f"{self.db_path}.compact"
+            with open(compact_path, "wb") as compact_file:
+                for line_offset in sorted(index_lines + list(latest.values())):
+                    db_file.seek(line_offset)
+                    compact_file.write(db_file.readline().rstrip(b"\r\n") + b"\n")
+                compact_file.flush()
+                os.fsync(compact_file.fileno())
+        os.replace(compact_path, self.db_path)
+        return len(latest)
+
+
+class WorldCatalogue:
+    """
+    The parsed world.json of every world in a Data/worlds directory, refreshed when a
+    world.json changes. With inotify_simple installed, an unchanged catalogue costs no
+    filesystem calls at all; otherwise it costs one stat per world.
+    """
+
+    WATCH_FLAGS = (
+        (
+            inotify_simple.flags.CREATE
+            | inotify_simple.flags.DELETE
+            | inotify_simple.flags.MOVED_FROM
+            | inotify_simple.flags.MOVED_TO
+            | inotify_simple.flags.CLOSE_WRITE
+        )
+        if inotify_simple
+        else 0
+    )
+
+    def __init__(self, worlds_path):
+        self.worlds_path = worlds_path
+        # world directory name -> ((mtime, size) of its world.json, parsed world.json)
+        self._entries = {}
+        self._scanned = False
+        self._lock = threading.Lock()
+        self._inotify = None
+        if inotify_simple:
+            try:
+                self._inotify = inotify_simple.INotify()
+            except OSError:
+                pass
+
+    def _unchanged(self) -> bool:
+        if not self._scanned or self._inotify is None:
+            return False
+        try:
+            return not self._inotify.read(timeout=0)
+        except OSError:
+            return False
+
+    def _watch(self, path):
+        if self._inotify is not None:
+            try:
+                self._inotify.add_watch(path, self.WATCH_FLAGS)
+            except OSError:
+                pass
+
+    def _scan(self):
+        try:
+            world_dirs = sorted(os.listdir(self.worlds_path))
+        except OSError:
+            self._entries = {}
+            return
+        self._watch(self.worlds_path)
+        entries = {}
+        for world_dir in world_dirs:
+            world_path = os.path.join(self.worlds_path, world_dir)
+            # watched even without a world.json, so one being written is noticed
+            self._watch(world_path)
+            try:
+                world_json_stat = os.stat(os.path.join(world_path, "world.json"))
+            except OSError:
+                continue
+            stamp = (world_json_stat.st_mtime_ns, world_json_stat.st_size)
+            cached = self._entries.get(world_dir)
+            if cached and cached[0] == stamp:
+                entries[world_dir] = cached
+                continue
+            try:
+                with open(os.path.join(world_path, "world.json")) as world_json:
+                    world_dict = json.load(world_json)
+            except (OSError, ValueError):
+                continue
+            if not world_dict.get("id"):
+                world_dict["id"] = world_dir
+            entries[world_dir] = (stamp, world_dict)
+        self._entries = entries
+        # only trust inotify once the directory exists and is being watched
+        self._scanned = os.path.isdir(self.worlds_path)
+
+    def worlds(self, active_world_id=None) -> list:
+        """Returns a copy of each world's world.json, with "active" set.
+
+        :param active_world_id: The id of the world the instance is running, if any
+        """
+        with self._lock:
+            if not self._unchanged():
+                self._scan()
+            entries = list(self._entries.items())
+        return [
+            {**world_dict, "active": world_dir == active_world_id}
+            for world_dir, (_, world_dict) in entries
+        ]
+
+
+_world_catalogues = {}
+_world_catalogues_lock = threading.Lock()
+
+
+def world_catalogue(worlds_path) -> WorldCatalogue:
+    worlds_path = os.path.abspath(worlds_path)
+    with _world_catalogues_lock:
+        if worlds_path not in _world_catalogues:
+            _world_catalogues[worlds_path] = WorldCatalogue(worlds_path)
+        return _world_catalogues[worlds_path]
@@ -1,5 +1,91 @@
+import os
+
 MANAGEMENT_PATH = "refractory"
 INSTANCE_PATH = "instances"
 MANAGED = True
 NICENESS = "nice"
 SERVER_PORT = 8080
+# Hours between scheduled snapshots of every instance; 0 turns scheduled snapshots off
+SNAPSHOT_INTERVAL_HOURS = float(
+    os.environ.get("REFRACTORY_SNAPSHOT_INTERVAL_HOURS", "0")
+)
+# Scheduled snapshots kept per instance
+SNAPSHOT_KEEP = int(os.environ.get("REFRACTORY_SNAPSHOT_KEEP", "14"))
+# Seconds to wait for foundry to shut a world down before exporting its databases
+WORLD_SHUTDOWN_TIMEOUT = float(
+    os.environ.get("REFRACTORY_WORLD_SHUTDOWN_TIMEOUT", "30")
+)
+# Memory for caching proxied foundry responses, such as release scripts and styles
+PROXY_CACHE_MB = int(os.environ.get("REFRACTORY_PROXY_CACHE_MB", "128"))
+# Compress text responses from foundry for browsers that accept gzip or brotli
+PROXY_COMPRESSION = os.environ.get("REFRACTORY_PROXY_COMPRESSION", "1") != "0"
+# Smaller responses gain too little from compression to be worth it
+PROXY_COMPRESSION_MIN_BYTES = int(
+    os.environ.get("REFRACTORY_PROXY_COMPRESSION_MIN_BYTES", "1024")
+)
+# permessage-deflate on the websocket between browsers and refractory; the settings
+# only apply to that side, foundry's side of the proxy is never compressed
+WEBSOCKET_DEFLATE = os.environ.get("REFRACTORY_WEBSOCKET_DEFLATE", "1") != "0"
+# LZ77 window for messages sent to browsers, 9-15; smaller uses less memory per player
+WEBSOCKET_DEFLATE_WINDOW_BITS = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_DEFLATE_WINDOW_BITS", "15")
+)
+# Window requested from browsers for the messages they send; 0 leaves it to them
+WEBSOCKET_DEFLATE_CLIENT_WINDOW_BITS = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_DEFLATE_CLIENT_WINDOW_BITS", "0")
+)
+# zlib memory level, 1-9, for the compressor of each connection
+WEBSOCKET_DEFLATE_MEM_LEVEL = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_DEFLATE_MEM_LEVEL", "8")
+)
+# Compress every message on its own, trading ratio for no per connection window
+WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER = (
+    os.environ.get("REFRACTORY_WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER", "0") != "0"
+)
+# Bytes a player's websocket may fall behind by before its foundry socket stops being
+# read from, or the player is disconnected if WEBSOCKET_SLOW_CLIENT_POLICY is "drop"
+WEBSOCKET_HIGH_WATER_BYTES = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_HIGH_WATER_BYTES", str(1024 * 1024))
+)
+# Bytes foundry may fall behind by before the player's websocket stops being read from
+WEBSOCKET_UPSTREAM_HIGH_WATER_BYTES = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_UPSTREAM_HIGH_WATER_BYTES", str(256 * 1024))
+)
+# "pause" or "drop"
+WEBSOCKET_SLOW_CLIENT_POLICY = os.environ.get(
+    "REFRACTORY_WEBSOCKET_SLOW_CLIENT_POLICY", "pause"
+)
+# Seconds to wait for a player's foundry websocket to open before closing theirs
+WEBSOCKET_CONNECT_TIMEOUT = float(
+    os.environ.get("REFRACTORY_WEBSOCKET_CONNECT_TIMEOUT", "10")
+)
+# Frames, and their total bytes, held from a player while their foundry websocket opens
+WEBSOCKET_PENDING_FRAMES = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_PENDING_FRAMES", "64")
+)
+WEBSOCKET_PENDING_BYTES = int(
+    os.environ.get("REFRACTORY_WEBSOCKET_PENDING_BYTES", str(256 * 1024))
+)
+# Proxy to foundry over a unix socket in each instance's directory instead of TCP;
+# foundry keeps its TCP port for refractory's own requests
+UNIX_SOCKET_UPSTREAM = os.environ.get("REFRACTORY_UNIX_SOCKET_UPSTREAM", "0") != "0"
+# Range of local ports handed to foundry processes
+INTERNAL_PORT_MIN = int(os.environ.get("REFRACTORY_INTERNAL_PORT_MIN", "30000"))
+INTERNAL_PORT_MAX = int(os.environ.get("REFRACTORY_INTERNAL_PORT_MAX", "30999"))
+# Seconds a released port is held back before reuse, to outlast TIME_WAIT
+PORT_QUARANTINE_SECONDS = float(
+    os.environ.get("REFRACTORY_PORT_QUARANTINE_SECONDS", "120")
+)
+# Minutes an instance may go without players or proxied requests before its foundry
+# process is stopped until someone visits it again; 0 keeps instances running
+HIBERNATE_IDLE_MINUTES = float(os.environ.get("REFRACTORY_HIBERNATE_IDLE_MINUTES", "0"))
+# Foundry processes kept started ahead of time for each version in
+# REFRACTORY_STANDBY_POOL_VERSIONS (comma separated), so activation skips node startup
+STANDBY_POOL_SIZE = int(os.environ.get("REFRACTORY_STANDBY_POOL_SIZE", "0"))
+STANDBY_POOL_VERSIONS = [
+    version_string.strip()
+    for version_string in os.environ.get("REFRACTORY_STANDBY_POOL_VERSIONS", "").split(
+        ","
+    )
+    if version_string.strip()
+]
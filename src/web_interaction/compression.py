@@ -0,0 +1,166 @@
+import zlib
+
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from refractory_settings import (
+    PROXY_COMPRESSION,
+    PROXY_COMPRESSION_MIN_BYTES,
+    WEBSOCKET_DEFLATE_CLIENT_WINDOW_BITS,
+    WEBSOCKET_DEFLATE_MEM_LEVEL,
+    WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER,
+    WEBSOCKET_DEFLATE_WINDOW_BITS,
+)
+
+COMPRESSIBLE_TYPES = {
+    b"application/javascript",
+    b"application/json",
+    b"application/manifest+json",
+    b"application/wasm",
+    b"application/xml",
+    b"font/otf",
+    b"font/ttf",
+    b"image/svg+xml",
+    b"text/css",
+    b"text/html",
+    b"text/javascript",
+    b"text/plain",
+    b"text/xml",
+}
+GZIP_LEVEL = 6
+# Brotli's quality 11 is far too slow to run per response; 5 is about gzip's speed
+BROTLI_QUALITY = 5
+
+
+def negotiate_encoding(request) -> bytes | None:
+    """Picks the response encoding for a request, preferring brotli, from Accept-Encoding.
+
+    :return: b"br", b"gzip", or None when the response should be sent as-is
+    :rtype: bytes | None
+    """
+    if not PROXY_COMPRESSION:
+        return None
+    accepted = set()
+    for coding in (request.getHeader(b"accept-encoding") or b"").split(b","):
+        name, _, params = coding.strip().lower().partition(b";")
+        if params.replace(b" ", b"") not in (b"q=0", b"q=0.0", b"q=0.00", b"q=0.000"):
+            accepted.add(name)
+    if brotli and b"br" in accepted:
+        return b"br"
+    if b"gzip" in accepted:
+        return b"gzip"
+    return None
+
+
+def should_compress(headers) -> bool:
+    """Whether a response with these headers is worth compressing."""
+    if headers.hasHeader(b"content-encoding"):
+        return False
+    content_type = headers.getRawHeaders(b"content-type", [b""])[0]
+    if content_type.split(b";")[0].strip().lower() not in COMPRESSIBLE_TYPES:
+        return False
+    content_length = headers.getRawHeaders(b"content-length", [None])[0]
+    if content_length is not None:
+        try:
+            return int(content_length) >= PROXY_COMPRESSION_MIN_BYTES
+        except ValueError:
+            return False
+    return True
+
+
+class StreamEncoder:
+    """Compresses a response body as it streams through, in gzip or brotli."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == b"br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits of 31 writes a gzip header and trailer
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def encode(self, data) -> bytes:
+        if self.encoding == b"br":
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == b"br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class FileEncoderFactory:
+    """
+    Compresses files as they are served from disk, in the negotiated encoding, when
+    wrapped around a File with twisted's EncodingResourceWrapper.
+    """
+
+    def encoderForRequest(self, request):
+        # a range of the uncompressed file can't be sent compressed
+        if request.getHeader(b"range"):
+            return None
+        encoding = negotiate_encoding(request)
+        if not encoding:
+            return None
+        request.setHeader(b"content-encoding", encoding)
+        request.setHeader(b"vary", b"accept-encoding")
+        return RequestEncoder(encoding, request)
+
+
+class RequestEncoder:
+    """Compresses a response written to a twisted request, for FileEncoderFactory."""
+
+    def __init__(self, encoding, request):
+        self.stream_encoder = StreamEncoder(encoding)
+        self.request = request
+
+    def encode(self, data) -> bytes:
+        if not self.request.startedWriting:
+            # the file's length no longer applies
+            self.request.responseHeaders.removeHeader(b"content-length")
+        return self.stream_encoder.encode(data)
+
+    def finish(self) -> bytes:
+        return self.stream_encoder.finish()
+
+
+def accept_permessage_deflate(
+    offers,
+    window_bits=WEBSOCKET_DEFLATE_WINDOW_BITS,
+    mem_level=WEBSOCKET_DEFLATE_MEM_LEVEL,
+    no_context_takeover=WEBSOCKET_DEFLATE_NO_CONTEXT_TAKEOVER,
+):
+    """Accepts a browser's permessage-deflate offer with the configured settings.
+
+    Used as perMessageCompressionAccept on the browser facing websocket factory.
+
+    :param offers: The extension offers made by the browser
+    :return: The accepted offer, or None to not compress
+    :rtype: PerMessageDeflateOfferAccept | None
+    """
+    for offer in offers:
+        if not isinstance(offer, PerMessageDeflateOffer):
+            continue
+        if offer.request_max_window_bits:
+            window_bits = min(window_bits, offer.request_max_window_bits)
+        request_max_window_bits = 0
+        if offer.accept_max_window_bits:
+            request_max_window_bits = WEBSOCKET_DEFLATE_CLIENT_WINDOW_BITS
+        return PerMessageDeflateOfferAccept(
+            offer,
+            request_max_window_bits=request_max_window_bits,
+            no_context_takeover=(
+                no_context_takeover or offer.request_no_context_takeover
+            ),
+            window_bits=window_bits,
+            mem_level=mem_level,
+        )
+    return None
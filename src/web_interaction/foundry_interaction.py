@@ -1,9 +1,15 @@
 import cgi
+import collections
 import os
 import os.path
 import zipfile
 import platform
+import shutil
+import stat
 import subprocess
+import tempfile
+import threading
+import time
 import urllib.parse
 from datetime import datetime
 
@@ -11,9 +17,17 @@ import logging
 import requests
 from bs4 import BeautifulSoup
 from django.http import HttpResponse
+from requests.adapters import HTTPAdapter
 from twisted.internet import reactor
 from twisted.python import log
 from twisted.web import proxy, server
+from urllib3.util.retry import Retry
+
+from refractory_home.storage import (
+    COMPRESSIBLE_EXTENSIONS,
+    MIN_COMPRESS_SIZE,
+    compress_static_file,
+)
 
 LOGGER = logging.getLogger("foundry_interaction")
 
@@ -25,6 +39,11 @@ TIMED_URL_APPROVED_HOSTS = ["r2.foundryvtt.com"]
 LOGIN_URL = f"{BASE_URL}/auth/login/"
 RELEASES_URL = f"{BASE_URL}/releases"
 
+RELEASE_OVERLAY_MARKER = ".refractory_overlay"
+# Written in a release once its text files have compressed variants next to them
+RELEASE_COMPRESSED_MARKER = ".refractory_compressed"
+WRITE_PERMISSIONS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
 POST_HEADERS = {
     "DNT": "1",
     "Referer": BASE_URL,
@@ -32,6 +51,88 @@ POST_HEADERS = {
     "User-Agent": "python-requests",
 }
 
+# (connect, read) timeouts in seconds for requests to the foundry site
+SITE_REQUEST_TIMEOUT = (10, 60)
+# Only idempotent requests are retried; the login POST is never replayed
+SITE_REQUEST_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD"]),
+    raise_on_status=False,
+)
+MAX_ACCOUNT_SESSIONS = 8
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Minimum seconds between download progress reports
+PROGRESS_INTERVAL = 0.5
+
+_site_sessions = {}
+_site_sessions_lock = threading.Lock()
+# requests sessions aren't guaranteed to be thread-safe, so each thread gets its own
+# anonymous one
+_anonymous_sessions = threading.local()
+# one extraction at a time for each release, by version string
+_extraction_locks = collections.defaultdict(threading.Lock)
+_extraction_locks_lock = threading.Lock()
+
+
+class FoundrySiteSession(requests.Session):
+    """
+    requests session for the foundry site, with pooled connections, retries for
+    idempotent requests and default timeouts.
+    """
+
+    def __init__(self):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=2, pool_maxsize=4, max_retries=SITE_REQUEST_RETRY
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", SITE_REQUEST_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def get_site_session(foundry_session_id=None) -> FoundrySiteSession:
+    """Gets a long-lived session for requests to the foundry site.
+
+    Sessions are kept per foundry account, so cookies never leak between accounts while
+    connections are reused between calls. Without a session id, the calling thread's
+    anonymous session is returned. Sessions returned here must not be closed by the
+    caller; sessions evicted to make room for other accounts are left for the garbage
+    collector, as another thread may still be using them.
+
+    :param foundry_session_id: The foundry site session id for the account, if any
+    :return: The session for the account
+    :rtype: FoundrySiteSession
+    """
+    if not foundry_session_id:
+        session = getattr(_anonymous_sessions, "session", None)
+        if session is None:
+            session = FoundrySiteSession()
+            _anonymous_sessions.session = session
+        return session
+    with _site_sessions_lock:
+        session = _site_sessions.pop(foundry_session_id, None)
+        if session is None:
+            session = FoundrySiteSession()
+            session.cookies.update({"sessionid": foundry_session_id})
+        # re-inserted to keep the dict in least to most recently used order
+        _site_sessions[foundry_session_id] = session
+        while len(_site_sessions) > MAX_ACCOUNT_SESSIONS:
+            _site_sessions.pop(next(iter(_site_sessions)))
+        return session
+
+
+def _register_site_session(foundry_session_id, session):
+    with _site_sessions_lock:
+        # a replaced session may still be in use elsewhere, so it isn't closed
+        _site_sessions.pop(foundry_session_id, None)
+        _site_sessions[foundry_session_id] = session
+
 
 def get_releases(session):
     parsed_releases = []
@@ -58,7 +159,7 @@ def get_releases(session):
             parsed_releases.append(
                 {"version": version, "build": build_no, "tags": tags, "date": date}
             )
-    except requests.ConnectionError:
+    except (requests.ConnectionError, requests.Timeout):
         LOGGER.warning("Couldn't fetch release page due to connection error")
     except requests.HTTPError:
         LOGGER.warning("Couldn't fetch release page due to server error")
@@ -80,18 +181,19 @@ def get_token(session):
 def foundry_site_login(username, password, resp=None):
     if not resp:
         resp = HttpResponse()
-    with requests.Session() as rsession:
-        tok = get_token(rsession)
-        canon_username = login(rsession, tok, username, password)
-        if canon_username:
-            cookies = rsession.cookies.get_dict()
-            session_id = cookies.get("sessionid", "")
-
-            cookie_kwargs = {"secure": True, "httponly": True, "samesite": "Strict"}
-            resp.set_signed_cookie(FOUNDRY_SESSION_COOKIE, session_id, **cookie_kwargs)
-            resp.set_signed_cookie(
-                FOUNDRY_USERNAME_COOKIE, canon_username, **cookie_kwargs
-            )
+    # a fresh session, so that a failed login can't pick up another account's cookies
+    rsession = FoundrySiteSession()
+    tok = get_token(rsession)
+    canon_username = login(rsession, tok, username, password)
+    session_id = rsession.cookies.get_dict().get("sessionid", "")
+    if canon_username and session_id:
+        _register_site_session(session_id, rsession)
+
+        cookie_kwargs = {"secure": True, "httponly": True, "samesite": "Strict"}
+        resp.set_signed_cookie(FOUNDRY_SESSION_COOKIE, session_id, **cookie_kwargs)
+        resp.set_signed_cookie(FOUNDRY_USERNAME_COOKIE, canon_username, **cookie_kwargs)
+    else:
+        rsession.close()
 
 
 def login(session, csrf_token, username, password):
@@ -111,8 +213,40 @@ def login(session, csrf_token, username, password):
     return None
 
 
+def _write_download(download_res, zip_file, progress_callback=None):
+    """Streams a download response to a file, reporting progress along the way.
+
+    :param download_res: A streamed requests response
+    :param zip_file: Path to write the downloaded file to
+    :param progress_callback: Called as progress_callback(bytes_done, bytes_total,
+        bytes_per_second) at most every PROGRESS_INTERVAL seconds and once at the end;
+        bytes_total is None if the server didn't send a content length
+    """
+    try:
+        bytes_total = int(download_res.headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        bytes_total = None
+    bytes_done = 0
+    started = last_report = time.monotonic()
+    with open(zip_file, "wb") as f:
+        for chunk in download_res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+            bytes_done += len(chunk)
+            now = time.monotonic()
+            if progress_callback and now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                progress_callback(bytes_done, bytes_total, bytes_done / (now - started))
+    if progress_callback:
+        elapsed = max(time.monotonic() - started, 0.001)
+        progress_callback(bytes_done, bytes_total, bytes_done / elapsed)
+
+
 def _download_linux_zip(
-    session, foundry_version, download_dir="foundry_releases_zip", platform="node"
+    session,
+    foundry_version,
+    download_dir="foundry_releases_zip",
+    platform="node",
+    progress_callback=None,
 ):
     download_url = f"{RELEASES_URL}/download"
     try:
@@ -125,9 +259,7 @@ def _download_linux_zip(
             filename = f"{foundry_version.version_string}.zip"
             zip_file = os.path.join(download_dir, filename)
             os.makedirs(download_dir, exist_ok=True)
-            with open(zip_file, "wb") as f:
-                for chunk in download_res.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            _write_download(download_res, zip_file, progress_callback)
             return True
     except Exception as ex:
         raise ex
@@ -167,7 +299,15 @@ def release_artifact_exists(foundry_version, download_dir="foundry_releases_zip"
 
 def ensure_version_extracted(
     foundry_version, output_path="foundry_releases", download_dir="foundry_releases_zip"
-):
+) -> bool:
+    """
+    Extracts a downloaded release if it isn't already, replacing an incomplete
+    extraction, and seals the release tree.
+
+    :return: Whether the release is extracted and sealed; False if it isn't downloaded
+        or another process is still finishing its extraction
+    :rtype: bool
+    """
     zip_filename = f"{foundry_version.version_string}.zip"
     zip_file_path = os.path.join(download_dir, zip_filename)
     release_dir = os.path.join(output_path, foundry_version.version_string)
@@ -176,13 +316,195 @@ def ensure_version_extracted(
     )
     if not os.path.exists(zip_file_path):
         return False
-    if not os.path.exists(test_for_file):
-        log.msg("extracting")
+    with _extraction_locks_lock:
+        extraction_lock = _extraction_locks[foundry_version.version_string]
+    with extraction_lock:
+        if not os.path.exists(test_for_file):
+            if os.path.exists(release_dir):
+                # releases are only ever renamed into place complete, so this is left
+                # from before they were
+                LOGGER.warning(f"removing incomplete extraction {release_dir}")
+                _remove_release_dir(release_dir, output_path)
+            log.msg("extracting")
+            if not _extract_release(zip_file_path, release_dir, output_path):
+                return False
+            try:
+                # the one place the canonical tree is changed, before it is sealed
+                _attempt_windows_package_update(
+                    foundry_version, releases_path=output_path
+                )
+            finally:
+                _set_tree_read_only(release_dir)
+        elif not os.path.exists(os.path.join(release_dir, RELEASE_COMPRESSED_MARKER)):
+            # extracted before releases came with compressed variants
+            _set_tree_read_only(release_dir, read_only=False)
+            try:
+                compress_release_files(release_dir)
+            finally:
+                _set_tree_read_only(release_dir)
+        elif os.access(release_dir, os.W_OK):
+            # extracted before release trees were sealed
+            _set_tree_read_only(release_dir)
+    return True
+
+
+def compress_release_files(release_dir):
+    """
+    Writes compressed variants next to the text files in a release's public directory,
+    for them to be served compressed straight from disk, then marks the release as done.
+    """
+    for public_path in [
+        os.path.join(release_dir, "resources", "app", "public"),
+        os.path.join(release_dir, "public"),
+    ]:
+        for root, _, files in os.walk(public_path):
+            for file_name in files:
+                if os.path.splitext(file_name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, file_name)
+                if os.path.islink(path) or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+                    continue
+                compress_static_file(path)
+    with open(os.path.join(release_dir, RELEASE_COMPRESSED_MARKER), "w") as marker_file:
+        marker_file.write("refractory")
+
+
+def _extract_release(zip_file_path, release_dir, output_path):
+    """
+    Extracts a release zip into a directory of its own next to release_dir, then renames
+    it into place, so release_dir only ever appears complete.
+
+    :return: Whether this extraction was put in place, rather than another process's
+    :rtype: bool
+    """
+    os.makedirs(output_path, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(
+        prefix=f".{os.path.basename(release_dir)}.", dir=output_path
+    )
+    try:
         with zipfile.ZipFile(zip_file_path, "r") as zip_ref:
-            zip_ref.extractall(release_dir)
-        with open(test_for_file, "w") as testfile:
+            zip_ref.extractall(staging_dir)
+        compress_release_files(staging_dir)
+        with open(os.path.join(staging_dir, "refractory"), "w") as testfile:
             testfile.write("refractory")
-        _attempt_windows_package_update(foundry_version, releases_path=output_path)
+        # mkdtemp makes the directory private
+        os.chmod(staging_dir, 0o755)
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    try:
+        os.rename(staging_dir, release_dir)
+    except OSError:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        if os.path.exists(os.path.join(release_dir, "refractory")):
+            # another process extracted it first
+            return False
+        raise
+    return True
+
+
+def _remove_release_dir(release_dir, output_path):
+    """
+    Moves a release directory out of the way in one rename, then deletes it, so a
+    half-deleted tree is never left under the release's name.
+    """
+    removed_dir = tempfile.mkdtemp(
+        prefix=f".{os.path.basename(release_dir)}.removed.", dir=output_path
+    )
+    os.rename(release_dir, os.path.join(removed_dir, "release"))
+    # sealed directories can't have their entries deleted
+    _set_tree_read_only(removed_dir, read_only=False)
+    shutil.rmtree(removed_dir, ignore_errors=True)
+
+
+def _set_tree_read_only(path, read_only=True):
+    """
+    Adds or removes write permissions on everything under path, including path itself.
+    Symlinks are skipped, since chmod would follow them.
+    """
+    entries = [path]
+    for root, dirs, files in os.walk(path):
+        entries.extend(os.path.join(root, name) for name in dirs + files)
+    for entry in entries:
+        if os.path.islink(entry):
+            continue
+        mode = stat.S_IMODE(os.stat(entry).st_mode)
+        os.chmod(entry, mode & ~WRITE_PERMISSIONS if read_only else mode | stat.S_IWUSR)
+
+
+def release_overlay_version(overlay_dir) -> str | None:
+    marker_path = os.path.join(overlay_dir, RELEASE_OVERLAY_MARKER)
+    if os.path.exists(marker_path):
+        with open(marker_path) as marker_file:
+            return marker_file.read().strip()
+    return None
+
+
+def build_release_overlay(foundry_version, overlay_dir, output_path="foundry_releases"):
+    """Builds a per-instance copy of a release tree out of links to the canonical files.
+
+    Files are hardlinked where possible, so the overlay shares disk space and page cache
+    with the canonical tree and looks like a regular tree to node. Symlinks are used
+    when the overlay is on a different filesystem. Directories are real, so files can be
+    added, and linked files are swapped for private copies by make_overlay_file_writable.
+
+    :param foundry_version: The version whose release tree should be linked
+    :param overlay_dir: The directory to build the overlay in; replaced if it exists
+    :param output_path: The base directory of extracted releases
+    """
+    release_dir = os.path.join(output_path, foundry_version.version_string)
+    remove_release_overlay(overlay_dir)
+    for root, dirs, files in os.walk(release_dir):
+        overlay_root = os.path.normpath(
+            os.path.join(overlay_dir, os.path.relpath(root, release_dir))
+        )
+        os.makedirs(overlay_root, exist_ok=True)
+        for name in files + [
+            name for name in dirs if os.path.islink(os.path.join(root, name))
+        ]:
+            source = os.path.join(root, name)
+            target = os.path.join(overlay_root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                continue
+            try:
+                os.link(source, target)
+            except OSError:
+                os.symlink(os.path.abspath(source), target)
+    with open(os.path.join(overlay_dir, RELEASE_OVERLAY_MARKER), "w") as marker_file:
+        marker_file.write(foundry_version.version_string)
+
+
+def make_overlay_file_writable(overlay_dir, relative_path) -> str:
+    """Replaces a linked file in a release overlay with a private, writable copy.
+
+    :param overlay_dir: The overlay directory
+    :param relative_path: Path of the file to patch, relative to the release root
+    :return: The path of the private copy, which is safe to modify
+    :rtype: str
+    """
+    overlay_root = os.path.abspath(overlay_dir)
+    path = os.path.abspath(os.path.join(overlay_root, relative_path))
+    if os.path.commonpath([overlay_root, path]) != overlay_root:
+        raise ValueError(f"{relative_path} is outside of the release overlay")
+    if os.path.islink(path) or (os.path.exists(path) and os.stat(path).st_nlink > 1):
+        private_copy = f"{path}.refractory_tmp"
+        shutil.copy2(path, private_copy)
+        os.chmod(
+            private_copy, stat.S_IMODE(os.stat(private_copy).st_mode) | stat.S_IWUSR
+        )
+        os.replace(private_copy, path)
+        # compressed variants of the release's file would be served in place of the patch
+        for suffix in (".gz", ".br"):
+            if os.path.lexists(f"{path}{suffix}"):
+                os.remove(f"{path}{suffix}")
+    return path
+
+
+def remove_release_overlay(overlay_dir):
+    if os.path.lexists(overlay_dir):
+        # only links and private copies live here, so the canonical tree is untouched
+        shutil.rmtree(overlay_dir)
 
 
 def _download_and_write_release(
@@ -190,14 +512,18 @@ def _download_and_write_release(
     foundry_version,
     output_path="foundry_releases",
     download_dir="foundry_releases_zip",
+    progress_callback=None,
 ):
+    # visiting the site first picks up its csrf cookie, as a browser would have
     get_token(session)
     try:
         filename = f"{foundry_version.version_string}.zip"
         zip_file = os.path.join(download_dir, filename)
         if not os.path.exists(zip_file):
             # raise Exception("doesn't exist")
-            success = _download_linux_zip(session, foundry_version)
+            success = _download_linux_zip(
+                session, foundry_version, progress_callback=progress_callback
+            )
             if not success:
                 raise Exception("didn't download")
         ensure_version_extracted(
@@ -228,7 +554,7 @@ def download_timed_url(
     foundry_version, foundry_timed_url, download_dir="foundry_releases_zip"
 ):
     try:
-        with requests.get(
+        with get_site_session().get(
             foundry_timed_url,
             stream=True,
         ) as download_res:
@@ -236,34 +562,35 @@ def download_timed_url(
             filename = f"{foundry_version.version_string}.zip"
             zip_file = os.path.join(download_dir, filename)
             os.makedirs(download_dir, exist_ok=True)
-            with open(zip_file, "wb") as f:
-                for chunk in download_res.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            _write_download(download_res, zip_file)
             ensure_version_extracted(foundry_version, download_dir=download_dir)
     except Exception:
         pass
     log.msg("Bad url")
 
 
-def download_single_release(foundry_version, foundry_session_id):
-    with requests.Session() as rsession:
-        rsession.cookies.update({"sessionid": foundry_session_id})
-        LOGGER.info(
-            f"downloading release {foundry_version.version_string} (build {foundry_version.build})"
-        )
-        foundry_version.download_status = foundry_version.DownloadStatus.DOWNLOADING
-        foundry_version.save()
-        success = False
-        try:
-            success = _download_and_write_release(rsession, foundry_version)
-        except Exception as ex:
-            LOGGER.exception(f"Exception while downloading")
-        foundry_version.download_status = (
-            foundry_version.DownloadStatus.DOWNLOADED
-            if success
-            else foundry_version.DownloadStatus.NOT_DOWNLOADED
+def download_single_release(
+    foundry_version, foundry_session_id, progress_callback=None
+):
+    rsession = get_site_session(foundry_session_id)
+    LOGGER.info(
+        f"downloading release {foundry_version.version_string} (build {foundry_version.build})"
+    )
+    foundry_version.download_status = foundry_version.DownloadStatus.DOWNLOADING
+    foundry_version.save()
+    success = False
+    try:
+        success = _download_and_write_release(
+            rsession, foundry_version, progress_callback=progress_callback
         )
-        foundry_version.save()
+    except Exception as ex:
+        LOGGER.exception(f"Exception while downloading")
+    foundry_version.download_status = (
+        foundry_version.DownloadStatus.DOWNLOADED
+        if success
+        else foundry_version.DownloadStatus.NOT_DOWNLOADED
+    )
+    foundry_version.save()
 
 
 def get_licenses(session, canon_username):
@@ -2,7 +2,10 @@ import json
 import logging
 import os.path
 import shutil
+import collections
+import functools
 import subprocess
+import time
 import urllib.parse
 
 from autobahn.twisted.resource import Resource, WebSocketResource
@@ -13,15 +16,46 @@ from autobahn.twisted.websocket import (
     WebSocketServerProtocol,
 )
 from socketio.packet import Packet
-from twisted.internet import reactor
-from twisted.web import error, proxy
-from twisted.web.server import Site
+from twisted.internet import protocol, reactor
+from twisted.internet.interfaces import IPushProducer
+from twisted.web import error, http, proxy
+from twisted.web.resource import EncodingResourceWrapper
+from twisted.web.server import NOT_DONE_YET, Site
+from zope.interface import implementer
 
 from django.http.request import HttpRequest
+from django.template.loader import render_to_string
 from django.core.handlers.base import BaseHandler
 
-from refractory_settings import INSTANCE_PATH
+from refractory_settings import (
+    INSTANCE_PATH,
+    PROXY_COMPRESSION_MIN_BYTES,
+    UNIX_SOCKET_UPSTREAM,
+    WEBSOCKET_CONNECT_TIMEOUT,
+    WEBSOCKET_PENDING_BYTES,
+    WEBSOCKET_PENDING_FRAMES,
+    WEBSOCKET_DEFLATE,
+    WEBSOCKET_HIGH_WATER_BYTES,
+    WEBSOCKET_SLOW_CLIENT_POLICY,
+    WEBSOCKET_UPSTREAM_HIGH_WATER_BYTES,
+)
+from refractory_home.storage import COMPRESSIBLE_EXTENSIONS
 from web_interaction import template_rewrite
+from web_interaction.compression import (
+    FileEncoderFactory,
+    StreamEncoder,
+    accept_permessage_deflate,
+    negotiate_encoding,
+    should_compress,
+)
+from web_interaction.static_resources import CachingFile, PrecompressedFile
+from web_interaction.response_cache import (
+    RESPONSE_CACHE,
+    UNCACHED_HEADERS,
+    CachedResponse,
+    MAX_CACHED_RESPONSE_BYTES,
+    response_lifetime,
+)
 
 DJANGO_HANDLER = BaseHandler()
 MIDDLEWARE_LOADED = False
@@ -88,6 +122,110 @@ class BlackholeResource(Resource):
         return b"Blocked by Refractory"
 
 
+class HibernatingResource(Resource):
+    """
+    Stands in for an instance whose foundry process was stopped for being idle. The
+    first request from someone who can see the instance starts it again, and everyone
+    gets a page that reloads itself until foundry is ready and takes the route back.
+
+    :param world_id: The world the instance had running, launched again on waking
+    """
+
+    isLeaf = True
+
+    def __init__(self, foundry_instance, wake, world_id=None):
+        super().__init__()
+        self.foundry_instance = foundry_instance
+        self.wake = wake
+        self.world_id = world_id
+
+    def render(self, request):
+        try:
+            cookies = get_twisted_request_cookies(request)
+            django_user = get_django_user_from_cookies(cookies)
+        except Exception:
+            django_user = None
+        if not self.foundry_instance.user_can_view(django_user):
+            request.setResponseCode(403)
+            return b"Blocked by Refractory"
+        self.wake(self.foundry_instance)
+        request.setResponseCode(503)
+        request.setHeader(b"retry-after", str(HIBERNATION_RETRY_SECONDS).encode())
+        request.setHeader(b"cache-control", b"no-store")
+        accept = request.getHeader(b"accept") or b""
+        if request.method == b"GET" and b"text/html" in accept:
+            request.setHeader(b"content-type", b"text/html; charset=utf-8")
+            page = render_to_string(
+                "instance_waking.html",
+                {
+                    "instance": self.foundry_instance,
+                    "retry_seconds": HIBERNATION_RETRY_SECONDS,
+                },
+            )
+            return page.encode()
+        # socket.io and other script requests retry on their own
+        return b"Instance is starting"
+
+
+# How often the websocket proxy had to hold frames back while connecting to foundry
+WEBSOCKET_METRICS = collections.Counter(
+    connections=0,
+    buffered_connections=0,
+    buffered_frames=0,
+    dropped_frames=0,
+    connect_timeouts=0,
+)
+# How often WEBSOCKET_METRICS is logged
+WEBSOCKET_METRICS_LOG_SECONDS = 15 * 60
+# Seconds the waiting page of a waking instance waits before reloading
+HIBERNATION_RETRY_SECONDS = 3
+
+
+def log_websocket_metrics():
+    logging.info(
+        "websocket proxy: "
+        + ", ".join(f"{name}={count}" for name, count in WEBSOCKET_METRICS.items())
+    )
+
+
+@implementer(IPushProducer)
+class PeerProducer:
+    """
+    Registered on one side's transport as its producer, so that while that side's send
+    buffer is over its high-water mark the other side stops being read from, and frames
+    wait in the kernel rather than in memory.
+
+    :param on_overflow: Called instead of pausing the peer, to deal with the slow side
+        some other way
+    """
+
+    def __init__(self, peer_transport, on_overflow=None):
+        self.peer_transport = peer_transport
+        self.on_overflow = on_overflow
+
+    def pauseProducing(self):
+        if self.on_overflow:
+            self.on_overflow()
+        else:
+            self.peer_transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.peer_transport.resumeProducing()
+
+    def stopProducing(self):
+        pass
+
+
+def couple_transports(consumer_transport, peer_transport, high_water, on_overflow=None):
+    consumer_transport.bufferSize = high_water
+    if consumer_transport.producer is not None:
+        # the HTTP channel the websocket was upgraded from
+        consumer_transport.unregisterProducer()
+    consumer_transport.registerProducer(
+        PeerProducer(peer_transport, on_overflow=on_overflow), True
+    )
+
+
 def build_websocket_reverse_proxy_client_protocol(
     server_instance, override_client_payload=None, headers={}
 ):
@@ -100,6 +238,10 @@ def build_websocket_reverse_proxy_client_protocol(
             return super().onConnecting(*args, **kwargs)
 
         def onOpen(self):
+            if server_instance.closed:
+                # the browser left, or gave up on us, while this was connecting
+                self.dropConnection(abort=True)
+                return
             server_instance.set_client(self)
 
         def onMessage(self, payload, isBinary):
@@ -122,10 +264,22 @@ def build_websocket_reverse_proxy_client_protocol(
 
 
 def build_websocket_reverse_proxy_protocol(
-    addr, host, port, override_server_payload=None, override_client_payload=None
+    addr,
+    host,
+    port,
+    override_server_payload=None,
+    override_client_payload=None,
+    connect=None,
+    on_connection_opened=None,
+    on_connection_closed=None,
 ):
     class WebsocketReverseProxyServerProtocol(WebSocketServerProtocol):
         def onConnect(self, request):
+            self.counted = False
+            self.closed = False
+            if on_connection_opened:
+                on_connection_opened()
+                self.counted = True
             self.params = request.params
             self.sent_messages = {}
             url = (
@@ -141,25 +295,91 @@ def build_websocket_reverse_proxy_protocol(
                 override_client_payload=override_client_payload,
                 headers=request.headers,
             )
-            reactor.connectTCP(host, port, factory)  # type: ignore
+            # frames the browser sends before the upstream socket opens
+            self.pending_frames = []
+            self.pending_bytes = 0
+            WEBSOCKET_METRICS["connections"] += 1
+            self.upstream_timeout = reactor.callLater(  # type: ignore
+                WEBSOCKET_CONNECT_TIMEOUT, self.upstream_timed_out
+            )
+            if connect:
+                connect(factory, timeout=WEBSOCKET_CONNECT_TIMEOUT)
+            else:
+                reactor.connectTCP(  # type: ignore
+                    host, port, factory, timeout=WEBSOCKET_CONNECT_TIMEOUT
+                )
 
         def onOpen(self):
             pass
 
+        def upstream_timed_out(self):
+            WEBSOCKET_METRICS["connect_timeouts"] += 1
+            logging.warning(f"websocket upstream for {self.peer} didn't open in time")
+            self.closed = True
+            # socket.io in the browser reconnects on its own
+            self.sendClose(code=1000, reason="Foundry is not responding")
+
         def set_client(self, client_instance):
             self.client_instance = client_instance
+            if self.upstream_timeout.active():
+                self.upstream_timeout.cancel()
+            if self.pending_frames:
+                WEBSOCKET_METRICS["buffered_connections"] += 1
+                WEBSOCKET_METRICS["buffered_frames"] += len(self.pending_frames)
+                for payload, isBinary in self.pending_frames:
+                    self.forward_message(payload, isBinary)
+            self.pending_frames = None
+            on_overflow = None
+            if WEBSOCKET_SLOW_CLIENT_POLICY == "drop":
+                on_overflow = self.drop_slow_client
+            couple_transports(
+                self.transport,
+                client_instance.transport,
+                WEBSOCKET_HIGH_WATER_BYTES,
+                on_overflow=on_overflow,
+            )
+            couple_transports(
+                client_instance.transport,
+                self.transport,
+                WEBSOCKET_UPSTREAM_HIGH_WATER_BYTES,
+            )
+
+        def drop_slow_client(self):
+            logging.info(
+                f"dropping websocket client {self.peer}, over {WEBSOCKET_HIGH_WATER_BYTES} bytes behind"
+            )
+            self.dropConnection(abort=True)
+
+        def forward_message(self, payload, isBinary):
+            pkt = to_socketio_packet(payload)
+            if pkt and pkt.id:
+                self.sent_messages[pkt.id] = pkt
+            if override_server_payload:
+                payload = override_server_payload(pkt).encode().encode()
+            # logging.debug(f"> {payload}")
+            self.client_instance.sendMessage(payload, isBinary=isBinary)
 
         def onMessage(self, payload, isBinary):
             if hasattr(self, "client_instance") and self.client_instance:
-                pkt = to_socketio_packet(payload)
-                if pkt and pkt.id:
-                    self.sent_messages[pkt.id] = pkt
-                if override_server_payload:
-                    payload = override_server_payload(pkt).encode().encode()
-                # logging.debug(f"> {payload}")
-                self.client_instance.sendMessage(payload, isBinary=isBinary)
+                self.forward_message(payload, isBinary)
+            elif self.pending_frames is not None:
+                if (
+                    len(self.pending_frames) < WEBSOCKET_PENDING_FRAMES
+                    and self.pending_bytes + len(payload) <= WEBSOCKET_PENDING_BYTES
+                ):
+                    self.pending_frames.append((payload, isBinary))
+                    self.pending_bytes += len(payload)
+                else:
+                    WEBSOCKET_METRICS["dropped_frames"] += 1
 
         def onClose(self, wasClean, code, reason):
+            self.closed = True
+            if getattr(self, "counted", False) and on_connection_closed:
+                on_connection_closed()
+                self.counted = False
+            upstream_timeout = getattr(self, "upstream_timeout", None)
+            if upstream_timeout and upstream_timeout.active():
+                upstream_timeout.cancel()
             if hasattr(self, "client_instance") and self.client_instance:
                 self.client_instance.sendClose(code=1000, reason=reason)
 
@@ -193,6 +413,219 @@ class OverrideProxyClientFactory(proxy.ProxyClientFactory):
         self.protocol = OverrideProxyClient  # type: ignore
 
 
+class EncodingProxyClient(OverrideProxyClient):
+    """
+    Compresses a proxied response on its way to the browser, when the browser negotiated
+    an encoding and the response is text that node didn't already compress.
+    """
+
+    def __init__(self, command, rest, version, headers, data, father, encoding=None):
+        super().__init__(command, rest, version, headers, data, father)
+        self.encoding = encoding
+        self.encoder = None
+
+    def handleEndHeaders(self):
+        response_headers = self.father.responseHeaders
+        if (
+            self.encoding
+            and self.father.method != b"HEAD"
+            and should_compress(response_headers)
+        ):
+            self.encoder = StreamEncoder(self.encoding)
+            response_headers.removeHeader(b"content-length")
+            response_headers.setRawHeaders(b"content-encoding", [self.encoding])
+            response_headers.addRawHeader(b"vary", b"Accept-Encoding")
+            etag = response_headers.getRawHeaders(b"etag", [None])[0]
+            if etag and not etag.startswith(b"W/"):
+                # the bytes no longer match node's, only their meaning
+                response_headers.setRawHeaders(b"etag", [b"W/" + etag])
+
+    def send_body(self, data):
+        self.father.write(data)
+
+    def handleResponsePart(self, buffer):
+        if self.encoder:
+            buffer = self.encoder.encode(buffer)
+        if buffer:
+            self.send_body(buffer)
+
+    def finish_encoding(self):
+        if self.encoder and not self._finished:
+            tail = self.encoder.finish()
+            self.encoder = None
+            if tail:
+                self.send_body(tail)
+
+    def handleResponseEnd(self):
+        self.finish_encoding()
+        super().handleResponseEnd()
+
+
+class CachingProxyClient(EncodingProxyClient):
+    """
+    Keeps a copy of a proxied response as it was sent to the browser, and caches it once
+    complete if allowed to.
+    """
+
+    def __init__(
+        self,
+        command,
+        rest,
+        version,
+        headers,
+        data,
+        father,
+        cache_key,
+        encoding=None,
+    ):
+        super().__init__(command, rest, version, headers, data, father, encoding)
+        self.cache_key = cache_key
+        self.response_body = []
+        self.response_size = 0
+        self.headers_received = False
+
+    def handleEndHeaders(self):
+        self.headers_received = True
+        super().handleEndHeaders()
+
+    def send_body(self, data):
+        if self.response_body is not None:
+            self.response_size += len(data)
+            if self.response_size > MAX_CACHED_RESPONSE_BYTES:
+                self.response_body = None
+            else:
+                self.response_body.append(data)
+        super().send_body(data)
+
+    @property
+    def response_complete(self) -> bool:
+        # connectionLost ends the response too, so a body cut short by upstream going
+        # away would otherwise be cached; without a content-length, a close is the end
+        return self.headers_received and self.length in (None, 0)
+
+    def handleResponseEnd(self):
+        self.finish_encoding()
+        if not self.response_complete:
+            self.response_body = None
+        if not self._finished and self.response_body is not None:
+            response_headers = http.Headers()
+            for name, values in self.father.responseHeaders.getAllRawHeaders():
+                if name.lower() not in UNCACHED_HEADERS:
+                    response_headers.setRawHeaders(name, values)
+            lifetime = response_lifetime(self.father.code, response_headers)
+            if lifetime:
+                RESPONSE_CACHE.put(
+                    self.cache_key,
+                    CachedResponse(
+                        self.father.code,
+                        list(response_headers.getAllRawHeaders()),
+                        b"".join(self.response_body),
+                        lifetime,
+                    ),
+                )
+        super().handleResponseEnd()
+
+
+class EncodingProxyClientFactory(OverrideProxyClientFactory):
+    def __init__(self, command, rest, version, headers, data, father, encoding=None):
+        super().__init__(command, rest, version, headers, data, father)
+        self.protocol = functools.partial(EncodingProxyClient, encoding=encoding)
+
+
+class CachingProxyClientFactory(OverrideProxyClientFactory):
+    def __init__(
+        self,
+        command,
+        rest,
+        version,
+        headers,
+        data,
+        father,
+        cache_key,
+        encoding=None,
+    ):
+        super().__init__(command, rest, version, headers, data, father)
+        self.protocol = functools.partial(
+            CachingProxyClient,
+            cache_key=cache_key,
+            encoding=encoding,
+        )
+
+
+class CachingReverseProxyResource(proxy.ReverseProxyResource):
+    """
+    A reverse proxy that compresses text responses for browsers that accept it, and
+    answers GETs from RESPONSE_CACHE where it can.
+
+    :param cache_policy: Called with the request and the upstream path, returning the
+        cache key to cache the response under, or None to not cache it
+    """
+
+    def __init__(self, host, port, path, cache_policy, connect=None, reactor=reactor):
+        super().__init__(host, port, path, reactor=reactor)
+        self.cache_policy = cache_policy
+        self.connect = connect
+
+    def getChild(self, path, request):
+        return CachingReverseProxyResource(
+            self.host,
+            self.port,
+            self.path + b"/" + urllib.parse.quote(path, safe=b"").encode("utf-8"),
+            self.cache_policy,
+            connect=self.connect,
+            reactor=self.reactor,
+        )
+
+    def forward(self, request, client_factory_class):
+        """
+        As ReverseProxyResource.render, but with the given client factory, and
+        connecting through self.connect.
+        """
+        request.requestHeaders.setRawHeaders(
+            b"host", [f"{self.host}:{self.port}".encode("ascii")]
+        )
+        request.content.seek(0, 0)
+        query = urllib.parse.urlparse(request.uri).query
+        rest = self.path + b"?" + query if query else self.path
+        client_factory = client_factory_class(
+            request.method,
+            rest,
+            request.clientproto,
+            request.getAllHeaders(),
+            request.content.read(),
+            request,
+        )
+        if self.connect:
+            self.connect(client_factory)
+        else:
+            self.reactor.connectTCP(self.host, self.port, client_factory)
+        return NOT_DONE_YET
+
+    def render(self, request):
+        # the resource is shared by every request to its path, so the factory is
+        # chosen per request rather than set on it
+        encoding = negotiate_encoding(request)
+        client_factory_class = functools.partial(
+            EncodingProxyClientFactory, encoding=encoding
+        )
+        cache_key = None
+        if request.method in (b"GET", b"HEAD") and not request.getHeader(b"range"):
+            cache_key = self.cache_policy(request, self.path)
+        if cache_key:
+            # entries are stored compressed, once per negotiated encoding
+            cache_key = (cache_key, encoding)
+            cached = RESPONSE_CACHE.get(cache_key)
+            if cached:
+                return cached.render(request)
+            if request.method == b"GET":
+                client_factory_class = functools.partial(
+                    CachingProxyClientFactory,
+                    cache_key=cache_key,
+                    encoding=encoding,
+                )
+        return self.forward(request, client_factory_class)
+
+
 class SocketIOReverseProxy(proxy.ReverseProxyResource):
     def __init__(self, host, port, path):
         proxy.ReverseProxyResource.__init__(self, host, port, path)
@@ -201,28 +634,64 @@ class SocketIOReverseProxy(proxy.ReverseProxyResource):
         self.port = port
         self.path = path
         self.ws_path = "socket.io"
+        # for telling when the instance was last used through the proxy
+        self.last_activity = time.monotonic()
+        self.websocket_connections = 0
         self.ws_redirect = (
             f"ws://{self.host}:{self.port}/{self.path.decode('utf8')}/{self.ws_path}/"
         )
         factory = WebSocketServerFactory()
+        if WEBSOCKET_DEFLATE:
+            factory.setProtocolOptions(
+                perMessageCompressionAccept=accept_permessage_deflate
+            )
         factory.protocol = build_websocket_reverse_proxy_protocol(
             self.ws_redirect,
             self.host,
             self.port,
             override_client_payload=self.rewrite_socketio_response,
+            connect=self.connect_upstream,
+            on_connection_opened=self.websocket_opened,
+            on_connection_closed=self.websocket_closed,
         )
         self.ws_proxy = WebSocketResource(factory)
-        self.rev_proxy = proxy.ReverseProxyResource(
-            self.host, self.port, b"/" + self.path
+        self.rev_proxy = CachingReverseProxyResource(
+            self.host,
+            self.port,
+            b"/" + self.path,
+            self.response_cache_policy,
+            connect=self.connect_upstream,
         )
 
+    def connect_upstream(self, factory, timeout=30):
+        return reactor.connectTCP(self.host, self.port, factory, timeout=timeout)
+
+    def websocket_opened(self):
+        self.websocket_connections += 1
+        self.last_activity = time.monotonic()
+
+    def websocket_closed(self):
+        self.websocket_connections -= 1
+        self.last_activity = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        if self.websocket_connections > 0:
+            return 0
+        return time.monotonic() - self.last_activity
+
+    def response_cache_policy(self, request, upstream_path):
+        query = urllib.parse.urlparse(request.uri).query
+        return (self.host, self.port, upstream_path, query)
+
     def rewrite_socketio_response(self, pkt, response_to=None):
         return pkt
 
     def render(self, request):
+        self.last_activity = time.monotonic()
         return self.rev_proxy.render(request)
 
     def getChild(self, path, request):
+        self.last_activity = time.monotonic()
         path_string = path.decode()
         if path_string.startswith(self.ws_path):
             return self.ws_proxy
@@ -230,12 +699,85 @@ class SocketIOReverseProxy(proxy.ReverseProxyResource):
             return self.rev_proxy.getChild(path, request)
 
 
+# Release files don't change, but their URLs are the same across versions, so browsers
+# revalidate them daily in case the instance was moved to another release
+RELEASE_CACHE_CONTROL = b"public, max-age=86400"
+# User data can be replaced at any time, and is only visible to the instance's users
+USER_DATA_CACHE_CONTROL = b"private, no-cache"
+# User data files served without involving node; anything else, such as world databases,
+# is left to foundry to serve or refuse
+USER_DATA_EXTENSIONS = {
+    ".apng",
+    ".avif",
+    ".bmp",
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".svg",
+    ".tiff",
+    ".webp",
+    ".aac",
+    ".flac",
+    ".m4a",
+    ".mid",
+    ".mp3",
+    ".oga",
+    ".ogg",
+    ".opus",
+    ".wav",
+    ".m4v",
+    ".mp4",
+    ".ogv",
+    ".webm",
+    ".otf",
+    ".ttf",
+    ".woff",
+    ".woff2",
+    ".css",
+    ".hbs",
+    ".html",
+    ".js",
+    ".json",
+    ".mjs",
+    ".pdf",
+}
+
+UNIX_SOCKET_LISTENER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "unix_socket_listener.js"
+)
+# Longest path a unix socket can be bound to, leaving room in sun_path for the NUL
+UNIX_SOCKET_PATH_MAX = 107
+
 DENY_ACTIONS = {
     "join": ["shutdown", "login", "adminLogin"],
     "auth": ["adminAuth", "auth"],
 }
 
 
+class FallbackClientFactory(protocol.ClientFactory):
+    """
+    Stands in for a client factory on a connection attempt, calling fallback instead
+    of the factory if it fails, so the factory can be connected some other way.
+    """
+
+    def __init__(self, factory, fallback):
+        self.factory = factory
+        self.fallback = fallback
+
+    def startedConnecting(self, connector):
+        self.factory.startedConnecting(connector)
+
+    def buildProtocol(self, addr):
+        return self.factory.buildProtocol(addr)
+
+    def clientConnectionLost(self, connector, reason):
+        self.factory.clientConnectionLost(connector, reason)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.fallback()
+
+
 def get_request_param(request, param_name):
     body = request.content.read().decode()
     request.content.seek(0)
@@ -256,13 +798,32 @@ def get_node_execuatable_for_major_version(major_version):
 
 
 class FoundryResource(SocketIOReverseProxy):
-    def __init__(self, foundry_instance, host="localhost", port=30000, log=True):
+    def __init__(
+        self, foundry_instance, host="localhost", port=30000, log=True, standby=None
+    ):
         self.foundry_instance = foundry_instance
         self.port = port
         self.host = host
+        self.unix_socket_path = None
+        if UNIX_SOCKET_UPSTREAM:
+            unix_socket_path = os.path.abspath(foundry_instance.unix_socket_path)
+            if len(os.fsencode(unix_socket_path)) > UNIX_SOCKET_PATH_MAX:
+                logging.warning(
+                    f"{unix_socket_path} is too long for a unix socket, using TCP"
+                )
+            else:
+                self.unix_socket_path = unix_socket_path
+                # one left by a foundry that was killed would refuse every connection
+                # until the new one is listening
+                try:
+                    os.unlink(unix_socket_path)
+                except FileNotFoundError:
+                    pass
         self.path = (INSTANCE_PATH + "/" + foundry_instance.instance_slug).encode()
         super().__init__(self.host, self.port, self.path)
         self.blackhole = BlackholeResource()
+        self.public_path = foundry_instance.public_path
+        self.user_data_path = os.path.join(foundry_instance.data_path, "Data")
         data_path = self.foundry_instance.data_path
         if not log:
             kwargs = {
@@ -271,20 +832,54 @@ class FoundryResource(SocketIOReverseProxy):
             }
         else:
             kwargs = {}
-        node_executable = get_node_execuatable_for_major_version(
-            self.foundry_instance.foundry_version.major_version
-        )
-        logging.debug(f"Using node executable {node_executable}")
-        foundry_command = [
-            node_executable,
-            foundry_instance.foundry_version.executable_path,
+        foundry_args = [
             f"--dataPath={data_path}",
             "--noupdate",
             f"--adminPassword={foundry_instance.admin_pass}",
             f"--adminKey={foundry_instance.admin_pass}",
         ]
+        preload = []
+        extra_env = {}
+        if self.unix_socket_path:
+            preload.append(UNIX_SOCKET_LISTENER_PATH)
+            extra_env["REFRACTORY_UNIX_SOCKET"] = self.unix_socket_path
+        if standby:
+            logging.debug(f"Using standby started for {standby.version_string}")
+            self.process = standby.bind(
+                foundry_instance.executable_path,
+                foundry_args,
+                env=extra_env,
+                preload=preload,
+            )
+            return
+        node_executable = get_node_execuatable_for_major_version(
+            self.foundry_instance.foundry_version.major_version
+        )
+        logging.debug(f"Using node executable {node_executable}")
+        foundry_command = [node_executable]
+        if foundry_instance.has_release_overlay:
+            # keep node resolving modules inside the overlay if files had to be symlinked
+            foundry_command += ["--preserve-symlinks", "--preserve-symlinks-main"]
+        for preload_path in preload:
+            foundry_command += ["--require", preload_path]
+        if extra_env:
+            kwargs["env"] = {**os.environ, **extra_env}
+        foundry_command += [foundry_instance.executable_path, *foundry_args]
         self.process = subprocess.Popen(foundry_command, *[], **kwargs)
 
+    def connect_upstream(self, factory, timeout=30):
+        # foundry only opens the socket once it is listening, and still listens on TCP
+        if self.unix_socket_path and os.path.exists(self.unix_socket_path):
+            connect_tcp = functools.partial(
+                super().connect_upstream, factory, timeout=timeout
+            )
+            return reactor.connectUNIX(
+                self.unix_socket_path,
+                FallbackClientFactory(factory, connect_tcp),
+                timeout=timeout,
+            )
+        return super().connect_upstream(factory, timeout=timeout)
+
     def get_base_url(self):
         return f"http://{self.host}:{self.port}"
 
@@ -296,6 +891,39 @@ class FoundryResource(SocketIOReverseProxy):
             self.process.kill()
             self.process.communicate(timeout=1)
 
+    def public_file(self, relative_path) -> str | None:
+        """
+        Resolves an unquoted path relative to the instance, such as scripts/foundry.js,
+        to a file in the release's public directory.
+        """
+        if not self.public_path:
+            return None
+        normalized_path = os.path.normpath(relative_path)
+        if normalized_path.startswith("..") or os.path.isabs(normalized_path):
+            return None
+        file_path = os.path.join(self.public_path, normalized_path)
+        if os.path.isfile(file_path):
+            return file_path
+        return None
+
+    def user_data_file(self, relative_path) -> str | None:
+        """
+        Resolves an unquoted path relative to the instance, such as
+        worlds/my-world/scenes/map.webp, to an asset in the instance's user data.
+        """
+        normalized_path = os.path.normpath(relative_path)
+        if normalized_path.startswith("..") or os.path.isabs(normalized_path):
+            return None
+        if os.path.splitext(normalized_path)[1].lower() not in USER_DATA_EXTENSIONS:
+            return None
+        segments = normalized_path.split(os.sep)
+        if any(segment.startswith(".") for segment in segments):
+            return None
+        file_path = os.path.join(self.user_data_path, normalized_path)
+        if os.path.isfile(file_path):
+            return file_path
+        return None
+
     def rewrite_socketio_response(self, pkt, response_to=None):
         return template_rewrite.rewrite_template_payload(
             pkt, response_to=response_to, instance=self.foundry_instance
@@ -330,5 +958,32 @@ class FoundryResource(SocketIOReverseProxy):
     def getChild(self, path, request):
         if self.check_for_deny(request):
             return self.blackhole
-        else:
-            return super().getChild(path, request)
+        self.last_activity = time.monotonic()
+        if request.method in (b"GET", b"HEAD"):
+            relative_path = b"/".join([path, *request.postpath])
+            relative_path = relative_path.decode(errors="replace")
+            # the same precedence as foundry, which looks in public before user data
+            file_path = self.public_file(relative_path)
+            if file_path:
+                # the file is the whole rest of the path, so traversal ends here
+                request.prepath.extend(request.postpath)
+                request.postpath = []
+                # compressed variants are written when the release is extracted
+                return PrecompressedFile(file_path, cache_control=RELEASE_CACHE_CONTROL)
+            file_path = self.user_data_file(relative_path)
+            if file_path:
+                request.prepath.extend(request.postpath)
+                request.postpath = []
+                user_data_res = CachingFile(
+                    file_path, cache_control=USER_DATA_CACHE_CONTROL
+                )
+                if (
+                    os.path.splitext(file_path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+                    and os.path.getsize(file_path) >= PROXY_COMPRESSION_MIN_BYTES
+                ):
+                    # user data changes under us, so it is compressed as it is sent
+                    return EncodingResourceWrapper(
+                        user_data_res, [FileEncoderFactory()]
+                    )
+                return user_data_res
+        return super().getChild(path, request)
@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+
+from twisted.web import http
+from twisted.web.resource import Resource
+
+from refractory_settings import PROXY_CACHE_MB
+
+# Responses bigger than this are streamed through without being cached
+MAX_CACHED_RESPONSE_BYTES = 8 * 1024 * 1024
+# Not stored with a cached response, since they describe the upstream connection
+UNCACHED_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"date"}
+
+
+def parse_cache_control(headers) -> dict:
+    directives = {}
+    for value in headers.getRawHeaders(b"cache-control", []):
+        for directive in value.split(b","):
+            name, _, argument = directive.strip().partition(b"=")
+            directives[name.lower()] = argument.strip(b'"')
+    return directives
+
+
+def response_lifetime(code, headers) -> float | None:
+    """How long a proxied response may be reused for, following its cache headers.
+
+    :param code: The response's status code
+    :param headers: The response's Headers
+    :return: The lifetime in seconds, or None if the response can't be cached
+    :rtype: float | None
+    """
+    if code != http.OK or headers.hasHeader(b"set-cookie"):
+        return None
+    vary = b",".join(headers.getRawHeaders(b"vary", [])).lower()
+    if b"*" in vary or b"cookie" in vary:
+        return None
+    cache_control = parse_cache_control(headers)
+    if b"no-store" in cache_control or b"private" in cache_control:
+        return None
+    max_age = cache_control.get(b"s-maxage", cache_control.get(b"max-age"))
+    if b"no-cache" in cache_control or not max_age:
+        return None
+    try:
+        return float(max_age) or None
+    except ValueError:
+        return None
+
+
+class CachedResponse(Resource):
+    isLeaf = True
+
+    def __init__(self, code, headers, body, lifetime):
+        super().__init__()
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.expires = time.monotonic() + lifetime
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(
+            len(name) + len(value) for name, values in self.headers for value in values
+        )
+
+    @property
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+    def render(self, request):
+        for name, values in self.headers:
+            request.responseHeaders.setRawHeaders(name, values)
+        etag = request.responseHeaders.getRawHeaders(b"etag", [None])[0]
+        if_none_match = request.getHeader(b"if-none-match")
+        if (
+            etag
+            and if_none_match
+            and etag in [tag.strip() for tag in if_none_match.split(b",")]
+        ):
+            request.setResponseCode(http.NOT_MODIFIED)
+            return b""
+        request.setResponseCode(self.code)
+        return self.body
+
+
+class ResponseCache:
+    """
+    An in-memory LRU cache of proxied responses, bounded by the bytes it holds. One cache
+    is shared by every instance, so that instances on the same release share the entries
+    for its files.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def get(self, key) -> CachedResponse | None:
+        response = self.entries.get(key)
+        if response and not response.is_fresh:
+            self.remove(key)
+            response = None
+        if response:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return response
+
+    def put(self, key, response):
+        if response.size > min(self.max_bytes, MAX_CACHED_RESPONSE_BYTES):
+            return
+        self.remove(key)
+        self.entries[key] = response
+        self.size += response.size
+        while self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        response = self.entries.pop(key, None)
+        if response:
+            self.size -= response.size
+
+
+RESPONSE_CACHE = ResponseCache(PROXY_CACHE_MB * 1024 * 1024)
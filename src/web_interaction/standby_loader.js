@@ -0,0 +1,69 @@
+// Run by refractory as a standby foundry process. Node starts up and the release's
+// dependencies are loaded ahead of time, then the process waits on stdin for a line of
+// JSON saying which instance to run as: foundry's entry script, its arguments, extra
+// environment, and modules to preload. Standbys exit if stdin closes before that, such
+// as when refractory stops.
+const fs = require("fs");
+const path = require("path");
+const Module = require("module");
+
+const appRoot = process.env.REFRACTORY_STANDBY_APP_ROOT;
+
+function warmDependencies(appRoot) {
+    let packageJson;
+    try {
+        packageJson = JSON.parse(
+            fs.readFileSync(path.join(appRoot, "package.json"), "utf8")
+        );
+    } catch (err) {
+        return;
+    }
+    if (!Module.createRequire) {
+        return;
+    }
+    // resolve from the release, the same as foundry will
+    const appRequire = Module.createRequire(path.join(appRoot, "package.json"));
+    for (const dependency of Object.keys(packageJson.dependencies || {})) {
+        try {
+            appRequire(dependency);
+        } catch (err) {
+            // ESM only, or not usable outside of foundry; it loads when foundry does
+        }
+    }
+}
+
+function run(binding) {
+    delete process.env.REFRACTORY_STANDBY_APP_ROOT;
+    Object.assign(process.env, binding.env || {});
+    for (const preload of binding.preload || []) {
+        require(preload);
+    }
+    // start the entry script the way node starts a main script, CommonJS or ESM
+    process.argv = [process.argv[0], binding.entry].concat(binding.args || []);
+    Module.runMain();
+}
+
+if (appRoot) {
+    warmDependencies(appRoot);
+}
+
+let received = "";
+let bound = false;
+process.stdin.setEncoding("utf8");
+process.stdin.on("data", function (chunk) {
+    if (bound) {
+        return;
+    }
+    received += chunk;
+    const newline = received.indexOf("\n");
+    if (newline === -1) {
+        return;
+    }
+    bound = true;
+    run(JSON.parse(received.slice(0, newline)));
+});
+process.stdin.on("end", function () {
+    if (!bound) {
+        process.exit(0);
+    }
+});
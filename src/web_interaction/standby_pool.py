@@ -0,0 +1,210 @@
+import collections
+import json
+import logging
+import os
+import subprocess
+import threading
+
+STANDBY_LOADER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "standby_loader.js"
+)
+
+
+class StandbyProcess:
+    """
+    A node process started ahead of time for a foundry release, waiting to be told
+    which instance to run as.
+    """
+
+    def __init__(self, version_string, node_executable, app_root):
+        self.version_string = version_string
+        self.node_executable = node_executable
+        self.process = subprocess.Popen(
+            [node_executable, STANDBY_LOADER_PATH],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env={**os.environ, "REFRACTORY_STANDBY_APP_ROOT": app_root},
+        )
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def bind(self, entry_path, args, env=None, preload=()) -> subprocess.Popen:
+        """
+        Starts foundry in the standby, as if it had been run with
+        node --require <preload> <entry_path> <args>.
+
+        :return: The standby's process, which is now foundry's
+        :rtype: subprocess.Popen
+        """
+        binding = {
+            "entry": entry_path,
+            "args": list(args),
+            "env": env or {},
+            "preload": list(preload),
+        }
+        self.process.stdin.write(json.dumps(binding).encode() + b"\n")
+        self.process.stdin.close()
+        return self.process
+
+    def stop(self):
+        try:
+            self.process.terminate()
+            self.process.communicate(timeout=1)
+        except Exception:
+            self.process.kill()
+            self.process.communicate(timeout=1)
+
+
+class StandbyPool:
+    """
+    Keeps up to size standby processes for each of a set of foundry releases, so
+    activating an instance doesn't wait on node starting up.
+    """
+
+    def __init__(self, size, version_strings):
+        self.size = size
+        self.version_strings = list(version_strings)
+        self.standbys = collections.defaultdict(collections.deque)
+        # releases being filled; fills run on more than one thread at once
+        self.filling = set()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and len(self.version_strings) > 0
+
+    def fill(self, version_string, node_executable, app_root):
+        with self.lock:
+            if version_string in self.filling:
+                # the fill already under way tops it up
+                return
+            self.filling.add(version_string)
+        try:
+            # at most size starts, so a release whose standbys die at once isn't retried
+            # forever
+            for _ in range(self.size):
+                with self.lock:
+                    standbys = self.standbys[version_string]
+                    # drop any that died while waiting
+                    for standby in [
+                        standby for standby in standbys if not standby.alive
+                    ]:
+                        standbys.remove(standby)
+                    if len(standbys) >= self.size:
+                        return
+                try:
+                    standby = StandbyProcess(version_string, node_executable, app_root)
+                except OSError:
+                    logging.exception(f"couldn't start a standby for {version_string}")
+                    return
+                with self.lock:
+                    self.standbys[version_string].append(standby)
+        finally:
+            with self.lock:
+                self.filling.discard(version_string)
+
+    def take(self, version_string, node_executable) -> StandbyProcess | None:
+        """
+        Takes a standby for a release. Standbys of other releases aren't handed out,
+        since they have their own release's dependencies loaded.
+        """
+        with self.lock:
+            standbys = self.standbys[version_string]
+            for standby in list(standbys):
+                if standby.node_executable != node_executable:
+                    continue
+                standbys.remove(standby)
+                if standby.alive:
+                    return standby
+        return None
+
+    def stop(self):
+        try:
+            self.process.terminate()
+            self.process.communicate(timeout=1)
+        except Exception:
+            self.process.kill()
+            self.process.communicate(timeout=1)
+
+
+class StandbyPool:
+    """
+    Keeps up to size standby processes for each of a set of foundry releases, so
+    activating an instance doesn't wait on node starting up.
+    """
+
+    def __init__(self, size, version_strings):
+        self.size = size
+        self.version_strings = list(version_strings)
+        self.standbys = collections.defaultdict(collections.deque)
+        # releases being filled; fills run on more than one thread at once
+        self.filling = set()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and len(self.version_strings) > 0
+
+    def fill(self, version_string, node_executable, app_root):
+        with self.lock:
+            if version_string in self.filling:
+                # the fill already under way tops it up
+                return
+            self.filling.add(version_string)
+        try:
+            # at most size starts, so a release whose standbys die at once isn't retried
+            # forever
+            for _ in range(self.size):
+                with self.lock:
+                    standbys = self.standbys[version_string]
+                    # drop any that died while waiting
+                    for standby in [
+                        standby for standby in standbys if not standby.alive
+                    ]:
+                        standbys.remove(standby)
+                    if len(standbys) >= self.size:
+                        return
+                try:
+                    standby = StandbyProcess(version_string, node_executable, app_root)
+                except OSError:
+                    logging.exception(f"couldn't start a standby for {version_string}")
+                    return
+                with self.lock:
+                    self.standbys[version_string].append(standby)
+        finally:
+            with self.lock:
+                self.filling.discard(version_string)
+
+    def take(self, version_string, node_executable) -> StandbyProcess | None:
+        """
+        Takes a standby for a release, or failing that one for another release that
+        runs on the same node executable, which has node started but nothing of the
+        release loaded. That leaves the other release a standby short until the pool is
+        next filled, which the caller is expected to do after every take.
+        """
+        with self.lock:
+            candidates = [self.standbys[version_string]] + [
+                standbys
+                for other_version, standbys in self.standbys.items()
+                if other_version != version_string
+            ]
+            for standbys in candidates:
+                for standby in list(standbys):
+                    if standby.node_executable != node_executable:
+                        continue
+                    standbys.remove(standby)
+                    if standby.alive:
+                        return standby
+        return None
+
+    def stop(self):
+        with self.lock:
+            standbys = [
+                standby for queue in self.standbys.values() for standby in queue
+            ]
+            self.standbys.clear()
+        for standby in standbys:
+            standby.stop()
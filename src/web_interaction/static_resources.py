@@ -0,0 +1,108 @@
+import os
+
+from twisted.web import http
+from twisted.web.static import File
+
+# For files whose URL changes whenever their content does
+IMMUTABLE_CACHE_CONTROL = b"public, max-age=31536000, immutable"
+
+
+def file_etag(path) -> bytes | None:
+    """A validator for a file from its size and modification time, as nginx builds them."""
+    try:
+        stat = path.getsize(), path.getModificationTime()
+    except OSError:
+        return None
+    return f'"{int(stat[1]):x}-{stat[0]:x}"'.encode()
+
+
+class CachingFile(File):
+    """
+    A static File that also sends an ETag, answers If-None-Match, and sets Cache-Control
+    on every file it serves.
+    """
+
+    def __init__(self, *args, cache_control=b"no-cache", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def createSimilarFile(self, path):
+        similar_file = super().createSimilarFile(path)
+        similar_file.cache_control = self.cache_control
+        return similar_file
+
+    def directoryListing(self):
+        return self.forbidden
+
+    def get_cache_control(self, request) -> bytes:
+        return self.cache_control
+
+    def render_GET(self, request):
+        if self.isfile():
+            etag = file_etag(self)
+            if etag:
+                request.setHeader(b"ETag", etag)
+                if_none_match = request.getHeader(b"If-None-Match")
+                if if_none_match and etag in [
+                    tag.strip() for tag in if_none_match.split(b",")
+                ]:
+                    request.setResponseCode(http.NOT_MODIFIED)
+                    request.setHeader(b"Cache-Control", self.get_cache_control(request))
+                    return b""
+            request.setHeader(b"Cache-Control", self.get_cache_control(request))
+        return super().render_GET(request)
+
+
+class PrecompressedFile(CachingFile):
+    """
+    A CachingFile that sends the .br or .gz variant written next to a file, to browsers
+    that accept it.
+    """
+
+    contentEncodings = {**File.contentEncodings, ".br": "br"}
+    # preferred first
+    precompressed_variants = [(b"br", ".br"), (b"gzip", ".gz")]
+
+    def accepted_variant(self, request):
+        accept_encoding = request.getHeader(b"Accept-Encoding") or b""
+        accepted = {
+            coding.split(b";")[0].strip().lower()
+            for coding in accept_encoding.split(b",")
+        }
+        for coding, suffix in self.precompressed_variants:
+            if coding in accepted:
+                variant = self.siblingExtension(suffix)
+                # a variant older than its source was left behind by an edited file
+                if (
+                    variant.isfile()
+                    and variant.getModificationTime() >= self.getModificationTime()
+                ):
+                    return variant
+        return None
+
+    def render_GET(self, request):
+        already_encoded = os.path.splitext(self.basename())[1] in self.contentEncodings
+        if self.isfile() and not already_encoded:
+            if any(
+                self.siblingExtension(suffix).isfile()
+                for _, suffix in self.precompressed_variants
+            ):
+                request.setHeader(b"Vary", b"Accept-Encoding")
+                variant = self.accepted_variant(request)
+                if variant:
+                    variant = self.createSimilarFile(variant.path)
+                    return variant.render_GET(request)
+        return super().render_GET(request)
+
+
+class StaticFilesResource(PrecompressedFile):
+    """
+    Serves STATIC_ROOT. URLs carrying the ?v= content hash added by the static files
+    storage are cached indefinitely, and the variants written at collectstatic time are
+    sent to browsers that accept them.
+    """
+
+    def get_cache_control(self, request) -> bytes:
+        if request.args.get(b"v"):
+            return IMMUTABLE_CACHE_CONTROL
+        return self.cache_control
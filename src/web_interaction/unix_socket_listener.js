@@ -0,0 +1,36 @@
+// Preloaded into foundry with node --require when refractory proxies to it over a unix
+// socket. Foundry's HTTP server keeps its TCP port, for refractory's own requests, and
+// also accepts connections on the socket named by REFRACTORY_UNIX_SOCKET.
+const fs = require("fs");
+const http = require("http");
+const net = require("net");
+
+const socketPath = process.env.REFRACTORY_UNIX_SOCKET;
+
+if (socketPath) {
+    const listen = http.Server.prototype.listen;
+    let attached = false;
+    http.Server.prototype.listen = function (...args) {
+        if (!attached) {
+            attached = true;
+            const server = this;
+            server.once("listening", function () {
+                try {
+                    fs.unlinkSync(socketPath);
+                } catch (err) {
+                    // no socket left over from a previous run
+                }
+                const unixServer = net.createServer(function (socket) {
+                    server.emit("connection", socket);
+                });
+                unixServer.listen(socketPath, function () {
+                    fs.chmodSync(socketPath, 0o600);
+                });
+                server.once("close", function () {
+                    unixServer.close();
+                });
+            });
+        }
+        return listen.apply(this, args);
+    };
+}
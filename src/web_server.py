@@ -2,22 +2,55 @@ import sys
 
 from django.urls import reverse, set_script_prefix
 from twisted.internet import reactor, threads
+from twisted.internet.task import LoopingCall
+from twisted.python.threadpool import ThreadPool
 from twisted.web.resource import Resource
 from twisted.web.server import NOT_DONE_YET, Site
 from twisted.web.wsgi import WSGIResource
 
 import web_interaction.foundry_resource
-from refractory_settings import MANAGEMENT_PATH
+from web_interaction import foundry_interaction
+from web_interaction.static_resources import (
+    CachingFile,
+    IMMUTABLE_CACHE_CONTROL,
+    StaticFilesResource,
+)
+from refractory_home import backups, thumbnails
+from refractory_settings import (
+    HIBERNATE_IDLE_MINUTES,
+    INTERNAL_PORT_MAX,
+    INTERNAL_PORT_MIN,
+    MANAGEMENT_PATH,
+    PORT_QUARANTINE_SECONDS,
+    SNAPSHOT_INTERVAL_HOURS,
+    SNAPSHOT_KEEP,
+    STANDBY_POOL_SIZE,
+    STANDBY_POOL_VERSIONS,
+)
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application as get_django_wsgi_application
-from web_interaction.foundry_resource import INSTANCE_PATH
+from web_interaction.foundry_resource import (
+    INSTANCE_PATH,
+    get_node_execuatable_for_major_version,
+)
+from web_interaction.standby_pool import StandbyPool
 
+import collections
+import os
 import queue
 import logging
+import socket
+import threading
+import time
 import uuid
 
 LOGGER = logging.getLogger("server")
 
-MIN_INTERNAL_PORT = 30000
+# Threads for long-running background tasks (e.g. release downloads), kept apart from the
+# reactor pool so they don't starve the WSGI handlers
+BACKGROUND_TASK_THREADS = 2
+# Seconds between looks for idle instances to hibernate
+IDLE_CHECK_SECONDS = 60
 _MODULE = sys.modules[__name__]
 
 
@@ -31,12 +64,97 @@ class HomeResource(Resource):
         return NOT_DONE_YET
 
 
+class ManagementResource(Resource):
+    """
+    The management site: static files are served by twisted, and everything else is
+    handed to django.
+    """
+
+    def __init__(self, django_res):
+        super().__init__()
+        self.django_res = django_res
+
+    def getChild(self, path, request):
+        # give the segment back, so django sees the whole path under the script prefix
+        request.postpath.insert(0, request.prepath.pop())
+        return self.django_res
+
+    def render(self, request):
+        # the bare management path, without a trailing slash, is django's too
+        return self.django_res.render(request)
+
+
+class PortAllocator:
+    """
+    Hands out internal ports for foundry processes from a fixed range.
+
+    Free ports are kept in a queue, so allocating doesn't depend on how many instances
+    are running. A port is only handed out if it can actually be bound, and released
+    ports sit in quarantine for a while so a quickly restarted instance doesn't collide
+    with connections to its old process that are still in TIME_WAIT.
+    """
+
+    def __init__(self, min_port, max_port, quarantine_seconds):
+        self.free = collections.deque(range(min_port, max_port + 1))
+        # (release time, port), oldest first
+        self.quarantine = collections.deque()
+        self.quarantine_seconds = quarantine_seconds
+        self.allocated = set()
+        # allocate runs on the activation worker, release on the reactor and wsgi threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def can_bind(port) -> bool:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            probe.bind(("", port))
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    def release_quarantined(self):
+        with self.lock:
+            self._release_quarantined()
+
+    def _release_quarantined(self):
+        now = time.monotonic()
+        while (
+            self.quarantine and now - self.quarantine[0][0] >= self.quarantine_seconds
+        ):
+            self.free.append(self.quarantine.popleft()[1])
+
+    def allocate(self) -> int | None:
+        with self.lock:
+            self._release_quarantined()
+            # each port is probed at most once per call
+            for _ in range(len(self.free)):
+                port = self.free.popleft()
+                if self.can_bind(port):
+                    self.allocated.add(port)
+                    return port
+                # in use by something else; try it again after the rest
+                self.free.append(port)
+            return None
+
+    def release(self, port):
+        with self.lock:
+            if port in self.allocated:
+                self.allocated.remove(port)
+                self.quarantine.append((time.monotonic(), port))
+
+
 class TaskQueue:
     def __init__(self):
         self.queue = queue.Queue()
         self.dispatching = False
         self.pending_ids = set()
         self.task_results = dict()
+        self.task_progress = dict()
+        self.background_pool = ThreadPool(
+            minthreads=0, maxthreads=BACKGROUND_TASK_THREADS, name="background_tasks"
+        )
 
     def queue_task(self, task, *args, task_id=None):
         if task_id == None:
@@ -45,6 +163,28 @@ class TaskQueue:
         self.pending_ids.add(task_id)
         return task_id
 
+    def run_task(self, task, *args, task_id=None):
+        """
+        Runs a task right away on the background pool, rather than waiting its turn in the
+        queue; for long tasks that don't need to be serialized with instance activation.
+        """
+        if task_id == None:
+            task_id = str(uuid.uuid4())
+        if not self.background_pool.started:
+            self.background_pool.start()
+            reactor.addSystemEventTrigger(
+                "before", "shutdown", self.background_pool.stop
+            )
+        self.pending_ids.add(task_id)
+        defered = threads.deferToThreadPool(reactor, self.background_pool, task, *args)
+        defered.addCallback(self.set_task_result, task_id, "DONE")
+        defered.addErrback(self.set_task_result, task_id, "ERROR")
+        return task_id
+
+    def is_pending(self, task_id) -> bool:
+        # unlike status, leaves a finished task's result for whoever is waiting on it
+        return task_id in self.pending_ids
+
     def status(self, task_id):
         if task_id in self.pending_ids:
             return "PENDING"
@@ -53,9 +193,21 @@ class TaskQueue:
         else:
             return "DNE"
 
-    def set_task_result(self, task_id, result):
+    def forget(self, task_id):
+        self.task_results.pop(task_id, None)
+
+    def progress(self, task_id):
+        return self.task_progress.get(task_id)
+
+    def set_task_progress(self, task_id, progress):
+        if task_id in self.pending_ids:
+            self.task_progress[task_id] = progress
+
+    def set_task_result(self, _, task_id, result):
+        # first argument is the value passed down the deferred's callback chain
         if task_id in self.pending_ids:
             self.pending_ids.remove(task_id)
+        self.task_progress.pop(task_id, None)
         self.task_results[task_id] = result
 
     def dispatch(self, *_, check=False, **__):
@@ -77,17 +229,36 @@ class RefractoryServer:
     def __init__(self):
         set_script_prefix(f"/{MANAGEMENT_PATH}/")
         self.task_queue = TaskQueue()
+        self.port_allocator = PortAllocator(
+            INTERNAL_PORT_MIN, INTERNAL_PORT_MAX, PORT_QUARANTINE_SECONDS
+        )
         self.foundry_resources = {}
+        self.standby_pool = StandbyPool(STANDBY_POOL_SIZE, STANDBY_POOL_VERSIONS)
+        # stopped for being idle, by instance name; the route stays until they're woken
+        self.hibernating_resources = {}
+        self.wake_task_ids = {}
         self.refractory_root_res = Resource()
         self.refractory_instances_res = Resource()
         self.site = Site(self.refractory_root_res)
         self.django_res = WSGIResource(
             reactor, reactor.getThreadPool(), get_django_wsgi_application()
         )
-        self.refractory_root_res.putChild(MANAGEMENT_PATH.encode(), self.django_res)
+        self.management_res = ManagementResource(self.django_res)
+        self.management_res.putChild(
+            settings.STATIC_URL.strip("/").encode(),
+            StaticFilesResource(settings.STATIC_ROOT),
+        )
+        self.refractory_root_res.putChild(MANAGEMENT_PATH.encode(), self.management_res)
         self.refractory_root_res.putChild(
             INSTANCE_PATH.encode(), self.refractory_instances_res
         )
+        os.makedirs(thumbnails.THUMBNAIL_PATH_BASE, exist_ok=True)
+        self.refractory_root_res.putChild(
+            thumbnails.THUMBNAIL_URL_PATH.encode(),
+            CachingFile(
+                thumbnails.THUMBNAIL_PATH_BASE, cache_control=IMMUTABLE_CACHE_CONTROL
+            ),
+        )
         self.refractory_instances_res.putChild(b"", HomeResource())
         self.refractory_root_res.putChild(b"", HomeResource())
 
@@ -96,57 +267,241 @@ class RefractoryServer:
         self.task_queue.dispatch(check=True)
         return task_id
 
+    def run_in_background(self, task, *args, task_id=None):
+        return self.task_queue.run_task(task, *args, task_id=task_id)
+
     def get_unassigned_port(self):
-        if not len(self.foundry_resources):
-            return MIN_INTERNAL_PORT
-        assigned_ports = [instance.port for instance in self.foundry_resources.values()]
-        for port in range(MIN_INTERNAL_PORT, max(assigned_ports) + 2):
-            if port not in assigned_ports:
-                return port
-        LOGGER.warning("port assignment failed")
+        port = self.port_allocator.allocate()
+        if port is None:
+            LOGGER.warning("port assignment failed")
+        return port
 
     def run(self, port=8080):
+        if SNAPSHOT_INTERVAL_HOURS > 0:
+            self.snapshot_loop = LoopingCall(
+                self.run_in_background, backups.snapshot_all_instances, SNAPSHOT_KEEP
+            )
+            self.snapshot_loop.start(SNAPSHOT_INTERVAL_HOURS * 60 * 60, now=False)
+        self.thumbnail_prune_loop = LoopingCall(
+            self.run_in_background, thumbnails.prune_thumbnails
+        )
+        self.thumbnail_prune_loop.start(thumbnails.THUMBNAIL_PRUNE_INTERVAL_SECONDS)
+        self.websocket_metrics_loop = LoopingCall(
+            web_interaction.foundry_resource.log_websocket_metrics
+        )
+        self.websocket_metrics_loop.start(
+            web_interaction.foundry_resource.WEBSOCKET_METRICS_LOG_SECONDS, now=False
+        )
+        if HIBERNATE_IDLE_MINUTES > 0:
+            self.idle_loop = LoopingCall(
+                self.run_in_background, self.hibernate_idle_instances
+            )
+            self.idle_loop.start(IDLE_CHECK_SECONDS, now=False)
+        if self.standby_pool.enabled:
+            self.run_in_background(self.fill_standby_pool)
+            reactor.addSystemEventTrigger("before", "shutdown", self.standby_pool.stop)
         reactor.listenTCP(port, self.site)
         reactor.run()
 
     def stop(self):
         reactor.stop()
 
-    def add_foundry_instance(self, foundry_instance):
+    def add_foundry_instance(self, foundry_instance, keep_waking_route=False):
+        """
+        :param keep_waking_route: Leave the waiting page of a hibernated instance at its
+            route, for the caller to hand back with end_hibernation once the instance is
+            ready
+        """
         port = self.get_unassigned_port()
         if port:
             instance_slug_bytes = foundry_instance.instance_slug.encode()
             precheck = foundry_instance.pre_activate(port)
             if precheck:
                 foundry_res = web_interaction.foundry_resource.FoundryResource(
-                    foundry_instance, port=port, log=False
+                    foundry_instance,
+                    port=port,
+                    log=False,
+                    standby=self.take_standby(foundry_instance),
                 )
-                self.refractory_instances_res.putChild(instance_slug_bytes, foundry_res)
+                waking = foundry_instance.instance_name in self.hibernating_resources
+                if not waking:
+                    self.refractory_instances_res.putChild(
+                        instance_slug_bytes, foundry_res
+                    )
                 self.foundry_resources[foundry_instance.instance_name] = foundry_res
                 foundry_instance.post_activate()
+                if waking and not keep_waking_route:
+                    # the waiting page keeps the route until foundry answers
+                    reactor.callFromThread(self.end_hibernation, foundry_instance)
                 LOGGER.info(
                     f"launched {foundry_instance.instance_name} - version {foundry_instance.foundry_version.version_string} - on internal port {port}"
                 )
                 return True
+            self.port_allocator.release(port)
         return False
 
     def remove_foundry_instance(self, foundry_instance):
         instance_slug_bytes = foundry_instance.instance_slug.encode()
         if self.refractory_instances_res.getStaticEntity(instance_slug_bytes):
             self.refractory_instances_res.delEntity(instance_slug_bytes)
+        self.hibernating_resources.pop(foundry_instance.instance_name, None)
         if foundry_instance.instance_name in self.foundry_resources:
             res = self.foundry_resources.pop(foundry_instance.instance_name)
             res.end_process()
+            self.port_allocator.release(res.port)
             LOGGER.info(
                 f"stopped {foundry_instance.instance_name} - version {foundry_instance.foundry_version.version_string}"
             )
 
+    def fill_standby_pool(self):
+        # imported here, as the models use the server
+        from refractory_home.models import FoundryVersion
+
+        for foundry_version in FoundryVersion.objects.filter(
+            version_string__in=self.standby_pool.version_strings
+        ):
+            # extracting is the slowest part of activating a new version; do it now too
+            foundry_interaction.ensure_version_extracted(foundry_version)
+            app_root = foundry_version.node_app_root
+            if not app_root:
+                continue
+            self.standby_pool.fill(
+                foundry_version.version_string,
+                get_node_execuatable_for_major_version(foundry_version.major_version),
+                app_root,
+            )
+
+    def take_standby(self, foundry_instance):
+        if not self.standby_pool.enabled:
+            return None
+        # standbys don't resolve modules the way a release overlay needs
+        if foundry_instance.has_release_overlay:
+            return None
+        foundry_version = foundry_instance.foundry_version
+        standby = self.standby_pool.take(
+            foundry_version.version_string,
+            get_node_execuatable_for_major_version(foundry_version.major_version),
+        )
+        self.run_in_background(self.fill_standby_pool)
+        return standby
+
+    def end_hibernation(self, foundry_instance):
+        """
+        Gives a woken instance's route back to its foundry resource. Runs in the reactor
+        thread.
+        """
+        self.hibernating_resources.pop(foundry_instance.instance_name, None)
+        foundry_res = self.foundry_resources.get(foundry_instance.instance_name)
+        if foundry_res:
+            self.refractory_instances_res.putChild(
+                foundry_instance.instance_slug.encode(), foundry_res
+            )
+
+    def detach_foundry_instance(self, foundry_instance, idle_seconds=0, world_id=None):
+        """
+        Puts a page at an instance's route that starts it again on the next visit, in
+        place of its foundry resource. Runs in the reactor thread, as it changes the
+        resource tree.
+
+        :param idle_seconds: Leave the instance be unless it has been idle this long
+        :param world_id: The world to launch again when the instance is woken
+        :return: The instance's foundry resource, for its process to be stopped, or None
+            if it wasn't running or isn't idle
+        """
+        foundry_res = self.foundry_resources.get(foundry_instance.instance_name)
+        if not foundry_res or foundry_res.idle_seconds() < idle_seconds:
+            return None
+        hibernating_res = web_interaction.foundry_resource.HibernatingResource(
+            foundry_instance, self.wake_foundry_instance, world_id=world_id
+        )
+        self.refractory_instances_res.putChild(
+            foundry_instance.instance_slug.encode(), hibernating_res
+        )
+        self.hibernating_resources[foundry_instance.instance_name] = hibernating_res
+        return self.foundry_resources.pop(foundry_instance.instance_name)
+
+    def hibernate_foundry_instance(self, foundry_instance, idle_seconds=0):
+        """
+        Stops an instance's foundry process, leaving a page at its route that starts it
+        again, with the world it had running, on the next visit. Runs outside the
+        reactor thread.
+        """
+        world_id = foundry_instance.active_world_id
+        res = threads.blockingCallFromThread(
+            reactor,
+            self.detach_foundry_instance,
+            foundry_instance,
+            idle_seconds,
+            world_id,
+        )
+        if not res:
+            return
+        res.end_process()
+        reactor.callFromThread(self.port_allocator.release, res.port)
+        LOGGER.info(f"hibernated idle instance {foundry_instance.instance_name}")
+
+    def wake_foundry_instance(self, foundry_instance):
+        # only queue another activation once the last one has finished without taking
+        # the route back, so a stream of requests doesn't queue one each
+        task_id = self.wake_task_ids.get(foundry_instance.instance_name)
+        if task_id and self.task_queue.is_pending(task_id):
+            return
+        if task_id:
+            self.task_queue.forget(task_id)
+        hibernating_res = self.hibernating_resources.get(foundry_instance.instance_name)
+        world_id = hibernating_res.world_id if hibernating_res else None
+        LOGGER.info(f"waking instance {foundry_instance.instance_name}")
+        self.wake_task_ids[foundry_instance.instance_name] = self.queue_and_dispatch(
+            self.relaunch_hibernated_instance, foundry_instance, world_id
+        )
+
+    def relaunch_hibernated_instance(self, foundry_instance, world_id=None):
+        """
+        Starts a hibernated instance and the world it had running, handing its route
+        back from the waiting page once the world is up, so players land where they
+        left off.
+        """
+        if not self.add_foundry_instance(foundry_instance, keep_waking_route=True):
+            return False
+        if world_id and not foundry_instance.activate_world(world_id):
+            LOGGER.warning(
+                f"couldn't launch {world_id} again on waking {foundry_instance.instance_name}"
+            )
+        reactor.callFromThread(self.end_hibernation, foundry_instance)
+        return True
+
+    def hibernate_idle_instances(self):
+        idle_seconds = HIBERNATE_IDLE_MINUTES * 60
+        foundry_resources = threads.blockingCallFromThread(
+            reactor, lambda: list(self.foundry_resources.values())
+        )
+        for foundry_res in foundry_resources:
+            if foundry_res.idle_seconds() < idle_seconds:
+                continue
+            foundry_instance = foundry_res.foundry_instance
+            try:
+                if foundry_instance.has_active_players():
+                    continue
+            except Exception:
+                LOGGER.exception(
+                    f"couldn't count players of {foundry_instance.instance_name}"
+                )
+                continue
+            # checked again in the reactor thread, in case someone has come back since
+            self.hibernate_foundry_instance(foundry_instance, idle_seconds=idle_seconds)
+
     def get_foundry_resource(self, foundry_instance):
         return self.foundry_resources.get(foundry_instance.instance_name, None)
 
     def get_active_instance_names(self):
         return self.foundry_resources.keys()
 
+    def get_license_holder_names(self):
+        # hibernated instances keep their license for when they are woken
+        return list(self.foundry_resources.keys()) + list(
+            self.hibernating_resources.keys()
+        )
+
     @classmethod
     def get_server(cls):
         if not hasattr(_MODULE, "_server"):